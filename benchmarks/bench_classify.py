@@ -0,0 +1,73 @@
+""" Times filename classification on synthetic paths, comparing the original
+    per-file Path and double re.match approach with the batch Classifier.
+
+    python -m benchmarks.bench_classify --stems 1000000
+"""
+
+import argparse
+from pathlib import Path
+from re import match
+import time
+
+from dctools.binaries import get_classifier
+
+
+item_pattern = r"^[a-z]+?-\d{6}$"
+member_pattern = r"^([a-z]+?-\d{6})-(\d{4})$"
+
+
+def synthetic_paths(count):
+    exts = ['.tif', '.hocr', '.xml', '.jpg']
+    paths = []
+    for n in range(count):
+        item, page = divmod(n, 400)
+        if page == 0:
+            paths.append(f"abc-{item:06d}/abc-{item:06d}.pdf")
+        elif page == 1:
+            paths.append(f"abc-{item:06d}/Thumbs.db")
+        else:
+            paths.append(
+                f"abc-{item:06d}/abc-{item:06d}-{page // 4:04d}{exts[page % 4]}"
+                )
+    return paths
+
+
+def classify_legacy(relpaths):
+    records = []
+    for relpath in relpaths:
+        f = Path(relpath)
+        item_match = match(item_pattern, f.stem)
+        member_match = match(member_pattern, f.stem)
+        if item_match:
+            item = f.stem
+            seq = None
+        elif member_match:
+            item = member_match.group(1)
+            seq = int(member_match.group(2))
+        else:
+            item = None
+            seq = None
+        records.append((relpath, item, seq, f.suffix))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stems', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    paths = synthetic_paths(args.stems)
+    classifier = get_classifier('default')
+    results = {}
+    for label, func in [("Path + 2x re.match", classify_legacy),
+                        ("Classifier batch", classifier.classify_batch)]:
+        started = time.perf_counter()
+        results[label] = func(paths)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<20} {elapsed:8.2f} s {len(paths) / elapsed:12,.0f} stems/s")
+    legacy, batch = results.values()
+    print("results identical" if legacy == batch else "RESULTS DIFFER")
+
+
+if __name__ == "__main__":
+    main()
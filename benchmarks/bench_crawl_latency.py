@@ -0,0 +1,58 @@
+""" Times a crawl that stats every file, with a fixed latency added to each
+    directory listing and stat to stand in for network storage, comparing the
+    threaded scan_tree (statting in each listing thread) with the AsyncCrawler
+    at several concurrency levels.
+
+    python -m benchmarks.bench_crawl_latency DIR --latency 0.002
+"""
+
+import argparse
+import os
+import time
+
+from dctools.aiocrawl import AsyncCrawler
+from dctools.binaries import DEFAULT_WORKERS, scan_dir, scan_tree
+
+
+def threaded(root, latency, workers=DEFAULT_WORKERS):
+    def scan(root, reldir):
+        time.sleep(latency)
+        files, subdirs = scan_dir(root, reldir)
+        stats = []
+        for relpath in files:
+            time.sleep(latency)
+            stat = os.stat(os.path.join(root, relpath))
+            stats.append((relpath, stat.st_size, stat.st_mtime_ns))
+        return stats, subdirs
+    return sorted(scan_tree(root, workers, scan))
+
+
+def crawled(root, latency, concurrency):
+    crawler = AsyncCrawler(concurrency, latency=latency)
+    return sorted(s for batch in crawler.crawl(root) for s in batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[16, 64, 256])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    expected = threaded(args.root, args.latency)
+    seconds = time.perf_counter() - started
+    print(f"{'threads':<16}{seconds:>8.2f} s  "
+          f"{len(expected) / seconds:>10,.0f} files/s")
+    for concurrency in args.concurrency:
+        started = time.perf_counter()
+        stats = crawled(args.root, args.latency, concurrency)
+        seconds = time.perf_counter() - started
+        assert stats == expected
+        print(f"{f'async x{concurrency}':<16}{seconds:>8.2f} s  "
+              f"{len(stats) / seconds:>10,.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
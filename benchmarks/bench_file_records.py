@@ -0,0 +1,88 @@
+""" Compares the memory held by FileSet records with the namedtuple-of-Path
+    records FileSet used previously.
+
+    python -m benchmarks.bench_file_records --files 1000000
+"""
+
+import argparse
+from collections import namedtuple
+import gc
+from pathlib import Path
+import time
+import tracemalloc
+
+from dctools.binaries import FileSet, get_classifier
+
+
+LegacyFile = namedtuple(
+    "LegacyFile", ['relpath', 'base', 'item', 'ext', 'seq', 'usage']
+    )
+
+
+def synthetic_paths(files, pages=200):
+    exts = ['.tif', '.hocr', '.xml']
+    n = 0
+    item = 0
+    while True:
+        item += 1
+        for page in range(1, pages + 1):
+            for ext in exts:
+                if n == files:
+                    return
+                yield f"batch{item % 10}/abc-{item:06d}/abc-{item:06d}-{page:04d}{ext}"
+                n += 1
+
+
+classifier = get_classifier('default')
+classify = FileSet(None, records=[]).classify
+
+
+def build_legacy(paths):
+    contents = set()
+    for relpath, item, seq, ext in map(classify, paths):
+        f = Path(relpath)
+        contents.add(LegacyFile(relpath=f,
+                                base=f.stem,
+                                item=item,
+                                ext=f.suffix,
+                                seq=seq,
+                                usage=classifier.usage(f.suffix)
+                                ))
+    return contents
+
+
+def build_compact(paths):
+    return FileSet(None, records=map(classify, paths))
+
+
+def measure(build, files):
+    """ Returns the memory retained by, and time taken for, building records
+        for the given number of files, including their path strings. """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(synthetic_paths(files))
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    legacy, legacy_time = measure(build_legacy, args.files)
+    compact, compact_time = measure(build_compact, args.files)
+    for label, size, elapsed in [("namedtuple + Path", legacy, legacy_time),
+                                 ("FileSet columns", compact, compact_time)]:
+        print(f"{label:<20} {size / 2**20:10.1f} MiB "
+              f"{size / args.files:8.1f} B/file {elapsed:8.2f} s")
+    print(f"saved {(legacy - compact) / 2**20:.1f} MiB "
+          f"({1 - compact / legacy:.0%}) for {args.files} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+""" Builds a synthetic collection for benchmarking: a tree of page files named
+    prefix-NNNNNN-NNNN.tif/.hocr/.xml with an item-level PDF per item, and the
+    matching Archelon batch CSV and Avalon batch manifest. The OCR sidecars
+    hold a minimal document naming their page and the TIFFs a 1x1 image; the
+    PDFs are empty.
+
+    python -m benchmarks.generate DIR --items 1000 --pages 50
+"""
+
+import argparse
+import csv
+import os
+from pathlib import Path
+import struct
+
+
+SIDECARS = {
+    '.hocr': (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body>\n'
+        '<div class="ocr_page" title="image {page}.tif; bbox 0 0 100 100">'
+        '</div>\n</body></html>\n'
+        ),
+    '.xml': (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<alto><Description><sourceImageInformation>'
+        '<fileName>{page}.tif</fileName></sourceImageInformation>'
+        '</Description><Layout/></alto>\n'
+        ),
+    }
+
+# A little-endian TIFF of one 8-bit grey pixel: the header, an IFD of width,
+# height, bits per sample, compression, strip offset and strip byte count, and
+# the pixel.
+TIFF = b"II*\x00" + struct.pack(
+    "<IH" + "HHII" * 6 + "I",
+    8, 6,
+    256, 3, 1, 1, 257, 3, 1, 1, 258, 3, 1, 8, 259, 3, 1, 1,
+    273, 4, 1, 8 + 2 + 6 * 12 + 4, 279, 4, 1, 1,
+    0,
+    ) + b"\x00"
+
+FORMATS = [
+    "http://vocab.lib.umd.edu/form#books",
+    "http://vocab.lib.umd.edu/form#photographs",
+    "http://vocab.lib.umd.edu/form#postcards",
+    ]
+
+
+def generate(target, items=1000, pages=50, prefix="abc", split_every=10,
+             items_per_dir=100):
+    """ Writes the tree to target/files, and target/archelon.csv and
+        target/avalon.csv beside it. Every split_every-th item is described by
+        two Archelon rows, each covering half of its pages. Returns the number
+        of files written. """
+    target = Path(target)
+    root = target / 'files'
+    count = 0
+    with open(target / 'archelon.csv', 'w', newline='') as archelon, \
+         open(target / 'avalon.csv', 'w', newline='') as avalon:
+        archelon_writer = csv.writer(archelon)
+        archelon_writer.writerow(['Identifier', 'Format', 'Title'])
+        avalon_writer = csv.writer(avalon)
+        avalon_writer.writerow(['Synthetic batch', 'dctools@example.edu'])
+        avalon_writer.writerow(
+            ['Title', 'Creator', 'Date Issued', 'Other Identifier', 'File']
+            )
+        for n in range(1, items + 1):
+            item = f"{prefix}-{n:06d}"
+            directory = root / f"batch{n // items_per_dir:04d}" / item
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f"{item}.pdf").touch()
+            count += 1
+            for seq in range(1, pages + 1):
+                page = f"{item}-{seq:04d}"
+                for ext in ('.tif', '.hocr', '.xml'):
+                    path = directory / f"{page}{ext}"
+                    if ext in SIDECARS:
+                        path.write_text(SIDECARS[ext].format(page=page))
+                    else:
+                        path.write_bytes(TIFF)
+                    count += 1
+            title = f"Synthetic item {n}, {pages} pages"
+            if split_every and n % split_every == 0 and pages > 1:
+                for start in (1, pages // 2 + 1):
+                    archelon_writer.writerow(
+                        [f"{item}-{start:04d}", FORMATS[0], title]
+                        )
+            else:
+                archelon_writer.writerow([item, FORMATS[n % len(FORMATS)], title])
+            avalon_writer.writerow(
+                [title, "Creator, Example", "2020", item, f"{item}-0001.mp4"]
+                )
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('target', help="directory to create the collection in")
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--prefix', default="abc")
+    parser.add_argument('--split-every', type=int, default=10,
+                        help="describe every Nth item with two rows (0: never)")
+    args = parser.parse_args()
+    os.makedirs(args.target, exist_ok=True)
+    count = generate(args.target, args.items, args.pages, args.prefix,
+                     args.split_every)
+    print(f"Wrote {count} files to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+""" Times the dctools hot paths against a collection made by
+    benchmarks.generate, running each stage in a fresh process so that its peak
+    RSS is its own, and writes the results as JSON for comparison between
+    commits.
+
+    python -m benchmarks.run DIR --output results.json [--baseline old.json]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def crawl(target):
+    from dctools.binaries import FileSet
+    seconds, fileset = timed(FileSet, str(target / 'files'))
+    return seconds, len(fileset), 'files'
+
+
+def get_members(target):
+    from dctools.binaries import FileSet
+    from dctools.populate_files_column import ArchelonBatchCsv
+    fileset = FileSet(str(target / 'files'))
+    rows = ArchelonBatchCsv(target / 'archelon.csv').rows
+    seconds, count = timed(lambda: sum(
+        len(fileset.get_members(row['Identifier'], row['next_id']))
+        for row in rows
+        ))
+    return seconds, count, 'files'
+
+
+def partition(target):
+    from dctools.binaries import FileSet
+    from dctools.populate_files_column import ArchelonBatchCsv
+    fileset = FileSet(str(target / 'files'))
+    rows = ArchelonBatchCsv(target / 'archelon.csv').rows
+
+    def assign():
+        partition = fileset.partition([row['Identifier'] for row in rows])
+        return sum(len(partition.get_members(row['Identifier']))
+                   for row in rows)
+    seconds, count = timed(assign)
+    return seconds, count, 'files'
+
+
+def get_best_images(target):
+    from dctools.binaries import FileSet
+    fileset = FileSet(str(target / 'files'))
+    seconds, count = timed(lambda: sum(
+        len(fileset.get_best_images(fileset.get_members(item)))
+        for item in fileset.index
+        ))
+    return seconds, count, 'files'
+
+
+def best_images(target):
+    from dctools.binaries import FileSet
+    fileset = FileSet(str(target / 'files'))
+    seconds, count = timed(lambda: sum(
+        len(files) for files in fileset.best_images().values()
+        ))
+    return seconds, count, 'files'
+
+
+def ocr_check(target):
+    from dctools.binaries import FileSet
+    from dctools.ocr import check_sidecars
+    fileset = FileSet(str(target / 'files'))
+    seconds, count = timed(check_sidecars, fileset)
+    return seconds, count, 'files'
+
+
+def image_check(target):
+    from dctools.binaries import FileSet
+    from dctools.images import probe_images
+    fileset = FileSet(str(target / 'files'))
+    seconds, count = timed(probe_images, fileset)
+    return seconds, count, 'files'
+
+
+def add_files_column(target):
+    from dctools.binaries import FileSet
+    from dctools.populate_files_column import ArchelonBatchCsv
+    fileset = FileSet(str(target / 'files'))
+    batch = ArchelonBatchCsv(target / 'archelon.csv')
+    seconds, _ = timed(batch.add_columns, fileset)
+    return seconds, len(batch.rows), 'rows'
+
+
+def avalon_from_csv(target):
+    from dctools.avalon import Batch
+    seconds, batch = timed(Batch.from_csv, target / 'avalon.csv')
+    return seconds, len(batch.contents), 'items'
+
+
+def validate(target):
+    from dctools.validate import validate
+    seconds, _ = timed(lambda: validate.main([str(target / 'files')],
+                                             standalone_mode=False))
+    count = sum(len(files) for _, _, files in os.walk(target / 'files'))
+    return seconds, count, 'files'
+
+
+STAGES = {
+    'crawl': crawl,
+    'get_members': get_members,
+    'partition': partition,
+    'get_best_images': get_best_images,
+    'best_images': best_images,
+    'ocr_check': ocr_check,
+    'image_check': image_check,
+    'add_files_column': add_files_column,
+    'avalon_from_csv': avalon_from_csv,
+    'validate': validate,
+    }
+
+
+def run_stage(name, target):
+    """ Runs one stage, with its output discarded, and returns its results. """
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        seconds, units, unit = STAGES[name](Path(target))
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return {
+        'seconds': round(seconds, 4),
+        'units': units,
+        'unit': unit,
+        'per_second': round(units / seconds, 1) if seconds else None,
+        'peak_rss_kb': peak,
+        }
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('target', help="directory made by benchmarks.generate")
+    parser.add_argument('--stage', action='append', choices=STAGES,
+                        help="stage to run (repeatable; default: all)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    args = parser.parse_args()
+
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'target': os.path.abspath(args.target),
+        'stages': {},
+        }
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['stages']
+
+    context = multiprocessing.get_context('spawn')
+    for name in args.stage or STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_stage, name, args.target).result()
+        results['stages'][name] = result
+        if 'error' in result:
+            print(f"{name:<18} failed: {result['error']}")
+            continue
+        line = (f"{name:<18} {result['seconds']:10.3f} s "
+                f"{result['per_second'] or 0:14,.0f} {result['unit']}/s "
+                f"{result['peak_rss_kb'] / 1024:10.1f} MiB peak")
+        before = baseline.get(name, {}).get('seconds')
+        if before:
+            line += f"  {result['seconds'] / before:6.2f}x baseline"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+""" Measures the cold-start import time of each dctools command with
+    python -X importtime, and exits with status 1 if any command takes longer
+    than the budget, listing the slowest imports of each command that does.
+
+    python -m benchmarks.startup [--budget MS] [--repeat N] [--top N]
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+# The modules that are imported to run each command through the dctools group.
+COMMANDS = {
+    'dctools': ['dctools.cli'],
+    'hello': ['dctools.cli', 'dctools.hello'],
+    'populate': ['dctools.cli', 'dctools.populate'],
+    'validate': ['dctools.cli', 'dctools.validate'],
+    }
+
+DEFAULT_BUDGET_MS = 150
+
+
+def import_times(modules):
+    """ Imports modules in a fresh interpreter and returns the self and
+        cumulative microseconds of each import, as (name, self, cumulative)
+        tuples with nested imports indented as importtime reports them. """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         "import " + ", ".join(modules)],
+        capture_output=True, text=True, check=True
+        )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((name.rstrip(), int(own), int(cumulative)))
+    return times
+
+
+def total_ms(times):
+    """ Sums the cumulative time of the top-level imports. """
+    return sum(c for name, _, c in times if not name.startswith('  ')) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help="maximum import time of a command, in ms")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="runs per command, of which the fastest counts")
+    parser.add_argument('--top', type=int, default=10,
+                        help="slowest imports to list for an over-budget "
+                             "command")
+    args = parser.parse_args()
+
+    over = False
+    for command, modules in COMMANDS.items():
+        runs = [import_times(modules) for _ in range(args.repeat)]
+        best = min(runs, key=total_ms)
+        ms = total_ms(best)
+        status = 'ok' if ms <= args.budget else 'OVER BUDGET'
+        print(f"{command:<12}{ms:>8.1f} ms   {status}")
+        if ms > args.budget:
+            over = True
+            for name, own, _ in sorted(best, key=lambda t: -t[1])[:args.top]:
+                print(f"    {own / 1000:>8.1f} ms  {name.strip()}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
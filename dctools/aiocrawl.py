@@ -0,0 +1,139 @@
+""" An asyncio crawl engine for trees on network storage, where each directory
+    listing and stat is a round trip to the server. Keeping many of them in
+    flight at once hides the latency that makes a serial crawl slow. """
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
+import queue
+import threading
+import time
+
+try:
+    from .binaries import scan_dir
+except ImportError:
+    from binaries import scan_dir
+
+
+DEFAULT_CONCURRENCY = 64
+
+# Stat results are passed on in batches of up to BATCH_SIZE files, and at most
+# DEFAULT_MAX_PENDING batches wait to be consumed before the crawl pauses.
+BATCH_SIZE = 256
+
+DEFAULT_MAX_PENDING = 64
+
+
+class AsyncCrawler:
+    """ Lists directories and stats files with asyncio, running the blocking
+        calls in a pool of concurrency threads so that up to that many are in
+        flight at a time. The (relpath, size, mtime_ns) of each file is
+        yielded in batches, and the crawl waits while max_pending batches are
+        unconsumed, so that a slow consumer holds back the crawl rather than
+        letting results pile up. A latency in seconds can be added to every
+        call to simulate network storage against a local directory. """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY,
+                 max_pending=DEFAULT_MAX_PENDING, latency=0.0, scan=scan_dir,
+                 stat=os.stat):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.latency = latency
+        self.scan = scan
+        self.stat = stat
+
+    def call(self, func, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        return func(*args)
+
+    def stat_file(self, root, relpath):
+        try:
+            stat = self.call(self.stat, os.path.join(root, relpath))
+        except OSError:
+            return None
+        return relpath, stat.st_size, stat.st_mtime_ns
+
+    async def run(self, root, emit):
+        """ Crawls root, passing each batch of stat results to the coroutine
+            emit. """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def in_thread(func, *args):
+            async with slots:
+                return await loop.run_in_executor(executor, func, *args)
+
+        async def walk(reldir):
+            files, subdirs = await in_thread(self.call, self.scan, root, reldir)
+            subtrees = [asyncio.ensure_future(walk(d)) for d in subdirs]
+            try:
+                files = iter(files)
+                while batch := list(islice(files, BATCH_SIZE)):
+                    stats = await asyncio.gather(*(
+                        in_thread(self.stat_file, root, relpath)
+                        for relpath in batch
+                        ))
+                    await emit([s for s in stats if s is not None])
+                await asyncio.gather(*subtrees)
+            finally:
+                for task in subtrees:
+                    task.cancel()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            await walk('')
+
+    def crawl(self, root):
+        """ Yields batches of (relpath, size, mtime_ns) for the files below
+            root. The event loop runs in a thread of its own, and the crawl is
+            cancelled if the generator is closed before it is exhausted. """
+        results = queue.Queue()
+        done = object()
+        ready = threading.Event()
+        state = {}
+
+        async def main():
+            state['loop'] = asyncio.get_running_loop()
+            state['task'] = asyncio.current_task()
+            state['pending'] = pending = asyncio.Semaphore(self.max_pending)
+            ready.set()
+
+            async def emit(batch):
+                await pending.acquire()
+                results.put(batch)
+
+            await self.run(root, emit)
+
+        def run_loop():
+            try:
+                asyncio.run(main())
+            except asyncio.CancelledError:
+                pass
+            except BaseException as e:
+                results.put(e)
+            finally:
+                ready.set()
+                results.put(done)
+
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+        ready.wait()
+        try:
+            while (batch := results.get()) is not done:
+                if isinstance(batch, BaseException):
+                    raise batch
+                # The loop may already have finished, leaving batches queued.
+                loop, pending = state['loop'], state['pending']
+                try:
+                    loop.call_soon_threadsafe(pending.release)
+                except RuntimeError:
+                    pass
+                yield batch
+        finally:
+            if thread.is_alive() and 'loop' in state:
+                try:
+                    state['loop'].call_soon_threadsafe(state['task'].cancel)
+                except RuntimeError:
+                    pass
+            thread.join()
@@ -1,24 +1,109 @@
+from collections import Counter, OrderedDict
 import csv
-import sys
 
+try:
+    from .metrics import NULL
+    from .output import Output, write_rows
+except ImportError:
+    from metrics import NULL
+    from output import Output, write_rows
 
-class Item:
 
-    _registry = {}
+# Items and pages only need to outlive the row that reaches them, so when
+# streaming the registry keeps just the most recently used objects.
+STREAM_REGISTRY_SIZE = 4096
+
+
+class Registry:
+    """ Holds the objects created during one run so that each identifier maps to
+        a single object of a class. With maxsize set, the least recently used
+        objects of a class are dropped once it holds more than maxsize. The
+        registry can be used as a context manager that releases everything on
+        exit. """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.objects = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __len__(self):
+        return sum(len(objects) for objects in self.objects.values())
+
+    def get(self, cls, identifier, *args):
+        """ Returns the cls object with the supplied identifier, creating it from
+            args (or from the identifier alone) if none is registered. """
+        objects = self.objects.setdefault(cls, OrderedDict())
+        try:
+            obj = objects[identifier]
+        except KeyError:
+            obj = objects[identifier] = cls(*args) if args else cls(identifier)
+            if self.maxsize is not None and len(objects) > self.maxsize:
+                objects.popitem(last=False)
+        else:
+            objects.move_to_end(identifier)
+        return obj
+
+    def values(self, cls):
+        return list(self.objects.get(cls, {}).values())
+
+    def discard(self, cls, identifier):
+        self.objects.get(cls, {}).pop(identifier, None)
+
+    def release(self, cls=None):
+        """ Drops the registered objects of cls, or of every class. """
+        if cls is None:
+            self.objects.clear()
+        else:
+            self.objects.pop(cls, None)
+
+
+class FileCounts:
+    """ Holds a set of files along with a count of them by extension, which is
+        kept current as files are added and discarded. """
+
+    def __init__(self):
+        self.files = set()
+        self.counts = Counter()
+
+    def add_file(self, f):
+        if f not in self.files:
+            self.files.add(f)
+            self.counts[f.ext] += 1
+
+    def discard_file(self, f):
+        if f in self.files:
+            self.files.remove(f)
+            self.counts[f.ext] -= 1
+            if not self.counts[f.ext]:
+                del self.counts[f.ext]
+
+    def count(self, ext):
+        return self.counts[ext]
+
+    def summarize(self):
+        file_counts = ", ".join(sorted(
+        	[f"{n} {e.strip('.')}" for e, n in self.counts.items()]
+        	))
+        return f"{self.identifier}: {file_counts}"
+
+
+class Item(FileCounts):
 
     def __init__(self, identifier):
+        super().__init__()
         self.identifier = identifier
-        self.files = set()
         self.pages = set()
 
     @classmethod
-    def from_registry(cls, identifier):
+    def from_registry(cls, identifier, registry):
         """ Returns the object with the supplied identifier or creates and registers a
                new object if none exists with the supplied identifier. """
-               
-        if identifier not in cls._registry:
-            cls._registry[identifier] = cls(identifier)
-        return cls._registry[identifier]
+        return registry.get(cls, identifier)
 
     def __lt__(self, other):
         return self.identifier < other.identifier
@@ -26,33 +111,19 @@ class Item:
     def __repr__(self):
         return f"Item Object ({self.identifier})"
 
-    def count(self, ext):
-        return len([f for f in self.files if f.ext == ext])
-
-    def summarize(self):
-        exts = set(f.ext for f in self.files)
-        file_counts = ", ".join(sorted(
-        	[f"{self.count(e)} {e.strip('.')}" for e in exts]
-        	))
-        return f"{self.identifier}: {file_counts}"
-
 
-class Page:
-
-    _registry = {}
+class Page(FileCounts):
 
     def __init__(self, identifier):
+        super().__init__()
         self.identifier = identifier
         self.seq = int(identifier.split('-')[-1])
-        self.files = set()
 
     @classmethod
-    def from_registry(cls, identifier):
+    def from_registry(cls, identifier, registry):
         """ Returns the object with the supplied identifier or creates and registers a 
             new object if none exists with the supplied identifier. """
-        if identifier not in cls._registry:
-            cls._registry[identifier] = cls(identifier)
-        return cls._registry[identifier]
+        return registry.get(cls, identifier)
 
     def __lt__(self, other):
         return self.identifier < other.identifier
@@ -60,58 +131,116 @@ class Page:
     def __repr__(self):
         return f"Page Object ({self.identifier})"
 
-    def count(self, ext):
-        return len([f for f in self.files if f.ext == ext])
-
-    def summarize(self):
-        exts = set(f.ext for f in self.files)
-        file_counts = ", ".join(sorted(
-        	[f"{self.count(e)} {e.strip('.')}" for e in exts]
-        	))
-        return f"{self.identifier}: {file_counts}"
-
 
 
 class MetadataCsv:
 
-    def __init__(self, path):
+    def __init__(self, path, stream=False, registry=None, metrics=NULL):
+        """ Reads the metadata rows of the CSV at path. With stream=True the rows
+            are instead read one at a time as they are written. The Items and
+            Pages built for the rows are held in the supplied registry, or in
+            a new one that is bounded when streaming. """
         self.path = path
+        self.stream = stream
+        if registry is None:
+            registry = Registry(STREAM_REGISTRY_SIZE if stream else None)
+        self.registry = registry
+        self.metrics = metrics
         with open(self.path, 'r') as handle:
             reader = csv.DictReader(handle)
             self.fieldnames = reader.fieldnames
-            self.rows = [row for row in reader]
-
-    def add_files_column(self, files):
+            if not stream:
+                self.rows = list(
+                    metrics.counted('read', with_next_ids(reader), 'rows')
+                    )
+        if stream:
+            self.rows = metrics.counted('read', read_rows(self.path), 'rows')
+
+    def apply(self, func, *args, stage='join'):
+        """ Calls func on each row: immediately when the rows are loaded, or as
+            each row is read when streaming. The rows are counted in stage. """
+        if self.stream:
+            self.rows = self.metrics.counted(
+                stage, lazy_apply(self.rows, func, *args), 'rows'
+                )
+        else:
+            with self.metrics.timed(stage, 'rows'):
+                for row in self.metrics.counted(stage, self.rows, 'rows'):
+                    func(row, *args)
+
+    def identifiers(self):
+        """ Returns the identifiers of the rows, reading them in a pass of their
+            own when streaming. """
+        if not self.stream:
+            return [row['Identifier'] for row in self.rows]
+        with open(self.path, 'r') as handle:
+            return [row['Identifier'] for row in csv.DictReader(handle)]
+
+    def partition(self, files):
+        """ Divides the member files among the rows, returning a Partition. """
+        with self.metrics.timed('partition', 'rows') as stage:
+            identifiers = self.identifiers()
+            partition = files.partition(identifiers)
+            stage.count += len(identifiers)
+        return partition
+
+    def add_files_column(self, files, partition=None):
+        """ Adds the FILES column, dividing the member files among the rows by
+            partition. Without one, loaded rows are partitioned, while each
+            streamed row takes the files from its start to the next row's,
+            so that output begins without a pass over the whole CSV. """
+        # The Items that group files into labelled pages are those of
+        # populate_files_column, which imports this module.
+        try:
+            from .populate_files_column import set_files
+        except ImportError:
+            from populate_files_column import set_files
         if 'FILES' not in self.fieldnames:
             self.fieldnames.append('FILES')
-        for row in self.rows:
-            sys.stderr.write(f"Working on {row['Identifier']}\n")
-            item = Item.from_registry(row)
-            item.get_members_and_files(files)
-            if not 'FILES' in row:
-                entries = []
-                for n, page in enumerate(sorted(item.pages), 1):
-                    entries.append(f"{item.label} {n}:" + ";".join(
-                        [f"{f.usage}{f.relpath}" for f in page.files]
-                        ))
-                row['FILES'] = ";".join(entries)
+        if partition is None and not self.stream:
+            partition = self.partition(files)
+        self.apply(set_files, files, self.registry, partition)
 
     def add_item_files_column(self, files):
         if 'ITEM_FILES' not in self.fieldnames:
             self.fieldnames.append('ITEM_FILES')
-        for row in self.rows:
-            if not 'ITEM_FILES' in row or row['ITEM_FILES'] == '':
-                row['ITEM_FILES'] = ';'.join(
-                    files.get_item_level(row['Identifier'])
-                    )
-
-    def write(self):
-        writer = csv.DictWriter(
-            sys.stdout,
-            fieldnames=self.fieldnames, 
-            extrasaction='ignore'
-            )
-        writer.writeheader()
-        for row in self.rows:
-            writer.writerow(row)
-
+        self.apply(self.set_item_files, files, stage='item_files')
+
+    def set_item_files(self, row, files):
+        if not 'ITEM_FILES' in row or row['ITEM_FILES'] == '':
+            row['ITEM_FILES'] = ';'.join(
+                files.get_item_level(row['Identifier'])
+                )
+
+    def write(self, path=None, format='csv', compress=False):
+        """ Writes the rows as CSV or JSON Lines to path, or to stdout, gzipped
+            if compress is set or path ends in .gz. """
+        with Output(path, compress) as handle, \
+             self.metrics.timed('write', 'rows'):
+            write_rows(handle, self.fieldnames,
+                       self.metrics.counted('write', self.rows, 'rows'), format)
+
+
+def with_next_ids(rows):
+    """ Yields each row with the identifier of the row after it (or None for the
+        last row) added as 'next_id', looking ahead by a single row. """
+    previous = None
+    for row in rows:
+        if previous is not None:
+            previous['next_id'] = row['Identifier']
+            yield previous
+        previous = row
+    if previous is not None:
+        previous['next_id'] = None
+        yield previous
+
+
+def read_rows(path):
+    with open(path, 'r') as handle:
+        yield from with_next_ids(csv.DictReader(handle))
+
+
+def lazy_apply(rows, func, *args):
+    for row in rows:
+        func(row, *args)
+        yield row
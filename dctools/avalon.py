@@ -1,6 +1,12 @@
+from collections import Counter
 import csv
 import os
 
+try:
+    from .output import Output
+except ImportError:
+    from output import Output
+
 
 class Batch:
     """ Class representing a batch of items to be loaded to Avalon. """
@@ -8,24 +14,58 @@ class Batch:
     def __init__(self, objects=None, title=None, contact=None, headers=None):
         self.title = title
         self.contact = contact
-        if objects:
-            self.contents = [Item(*obj) for obj in objects]
+        self.headers = headers
+        self.contents = [Item(*obj) for obj in objects] if objects else []
 
     @classmethod
-    def from_csv(cls, filepath):
-        """ Populate a Batch object using the contents of an existing Avalon CSV. """
-        
-        with open(filepath) as handle:
-            title, contact = handle.readline().strip().split(',')[:2]
-            fields = handle.readline().strip().split(',')
-            reader = csv.reader(handle.read().split('\n'))
-            items = [list(zip(fields, row)) for row in reader if row]
+    def from_csv(cls, filepath, stream=False):
+        """ Populate a Batch object using the contents of an existing Avalon CSV.
+            With stream=True, contents is instead a generator that reads one
+            item at a time. """
+
+        with open(filepath, newline='') as handle:
+            reader = csv.reader(handle)
+            title, contact = (next(reader, []) + ['', ''])[:2]
+            fields = next(reader, [])
+        batch = cls(title=title, contact=contact, headers=fields)
+        items = read_items(filepath)
+        batch.contents = items if stream else list(items)
+        return batch
 
-        return cls(items, batchtitle=title, batchcontact=contact, batchheaders=fields)
+    def get_headers(self):
+        """ Returns the batch headers, or derives them from the items, repeating
+            a key as many times as any item uses it. """
+        if self.headers is not None:
+            return self.headers
+        headers = []
+        counts = Counter()
+        for item in self.contents:
+            for key, n in Counter(key for key, _ in item.fields).items():
+                headers.extend([key] * (n - counts[key]))
+                counts[key] = max(counts[key], n)
+        return headers
 
     def serialize(self, outputpath):
         """ Write the batch metadata into a CSV file at the specified path. """
-        pass
+        headers = self.get_headers()
+        with Output(outputpath) as handle:
+            writer = csv.writer(handle)
+            writer.writerow([self.title, self.contact])
+            writer.writerow(headers)
+            for item in self.contents:
+                writer.writerow(item.row(headers))
+
+
+def read_items(filepath):
+    """ Yields an Item for each row of an Avalon CSV, below its two header
+        rows. Quoted cells may span lines. """
+    with open(filepath, newline='') as handle:
+        reader = csv.reader(handle)
+        next(reader, None)
+        fields = next(reader, [])
+        for row in reader:
+            if any(row):
+                yield Item(*zip(fields, row))
 
 
 class Item:
@@ -33,6 +73,7 @@ class Item:
             batch load. """
 
     def __init__(self, *args):
+        self.fields = list(args)
         self.metadata = dict()
         for key, value in args:
             if value and value != "":
@@ -44,6 +85,19 @@ class Item:
             lines.append(f"{key.upper()}: {'; '.join([v for v in values])}")
         return "\n".join(lines)
 
+    def row(self, headers):
+        """ Returns the item's values in the order of headers. A key repeated in
+            headers takes the item's values for that key in turn. """
+        values = {}
+        for key, value in self.fields:
+            values.setdefault(key, []).append(value)
+        seen = Counter()
+        row = []
+        for key in headers:
+            n = seen[key]
+            seen[key] += 1
+            row.append(values[key][n] if n < len(values.get(key, ())) else "")
+        return row
 
 
 
@@ -1,82 +1,619 @@
-from collections import namedtuple
-from collections.abc import Collection
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Collection, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
 from pathlib import Path
-from re import match
+from queue import Queue
+import re
+import zlib
 
+try:
+    from .archelon import Item, Page
+    from .metrics import NULL
+except ImportError:
+    from archelon import Item, Page
+    from metrics import NULL
 
-class FileSet(Collection):
 
-    File = namedtuple("File", ['relpath', 'base', 'item', 'ext', 'seq', 'usage'])
-
-    item_pattern = r"^[a-z]+?-\d{6}$"
-    member_pattern = r"^([a-z]+?-\d{6})-(\d{4})$"
-
-    use_ext = {".tif": "<preservation>",
-               ".jpg": "<preservation>",
-               ".hocr": "<ocr>",
-               ".xml": "<ocr>"}
-
-    def __init__(self, root):
-        self.contents = set()
-        files = [p for p in Path(root).rglob("*") if p.is_file()]
-
-        for f in files:
-            item_match = match(self.item_pattern, f.stem)
-            member_match = match(self.member_pattern, f.stem)
-            if item_match:
-                item = f.stem
-                seq = None
-            elif member_match:
-                item = member_match.group(1)
-                seq = int(member_match.group(2))
+DEFAULT_WORKERS = 8
+
+# Image formats in order of preference when selecting an item's best images.
+IMAGE_EXTS = ('.tif', '.jpg')
+
+
+def scan_dir(root, reldir):
+    """ Lists one directory, returning the relative paths of its files and of
+        its subdirectories. Symlinked directories are not descended into. """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(os.path.join(root, reldir)) as entries:
+            for entry in entries:
+                relpath = os.path.join(reldir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(relpath)
+                elif entry.is_file():
+                    files.append(relpath)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+    return files, subdirs
+
+
+def scan_tree(root, workers=DEFAULT_WORKERS, scan=scan_dir):
+    """ Yields the path, relative to root, of every file below root. Directories
+        are listed concurrently by a pool of worker threads, and files are
+        yielded as each listing completes. A different scan function with the
+        same signature as scan_dir can be supplied to change what is yielded
+        for each directory. """
+    results = Queue()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pool.submit(scan, root, '').add_done_callback(results.put)
+        outstanding = 1
+        while outstanding:
+            files, subdirs = results.get().result()
+            outstanding -= 1
+            for reldir in subdirs:
+                pool.submit(scan, root, reldir).add_done_callback(results.put)
+                outstanding += 1
+            yield from files
+
+
+def shard_scan(shard, shards, scan=scan_dir):
+    """ Returns a scan function for scan_tree that keeps, of the files in each
+        directory, only those of directories that fall in shard (numbered from
+        0) when they are divided among shards by a hash of their relative
+        paths. Every directory is descended into, so that a tree is divided
+        among shards however deep its files lie; files directly in the root
+        fall in shard 0. """
+    def scan_shard(root, reldir):
+        files, subdirs = scan(root, reldir)
+        # The root's path is empty, whose hash is 0.
+        if zlib.crc32(os.fsencode(reldir)) % shards != shard:
+            files = []
+        return files, subdirs
+    return scan_shard
+
+
+class Classifier:
+    """ Classifies files by the naming convention of a collection. A stem that
+        matches the item pattern is an item-level file; one that matches the
+        item pattern followed by a hyphen and the sequence pattern is a member
+        of that item. Both cases are tested by one precompiled pattern. """
+
+    def __init__(self, item=r"[a-z]+?-\d{6}", seq=r"\d{4}", use_ext=None):
+        self.pattern = re.compile(
+            rf"(?P<item>{item})(?:-(?P<seq>{seq}))??"
+            )
+        self.use_ext = use_ext if use_ext is not None else {
+            ".tif": "<preservation>",
+            ".jpg": "<preservation>",
+            ".hocr": "<ocr>",
+            ".xml": "<ocr>"
+            }
+
+    @property
+    def signature(self):
+        return self.pattern.pattern
+
+    def usage(self, ext):
+        return self.use_ext.get(ext)
+
+    def classify_batch(self, relpaths):
+        """ Returns a (relpath, item, seq, ext) record for each of a batch of
+            paths. Stems and suffixes follow the rules of Path.stem and
+            Path.suffix. """
+        fullmatch = self.pattern.fullmatch
+        sep = os.sep
+        records = []
+        append = records.append
+        for relpath in relpaths:
+            name = relpath.rpartition(sep)[2]
+            stem, dot, ext = name.rpartition('.')
+            if stem and ext:
+                ext = dot + ext
+            else:
+                stem, ext = name, ''
+            m = fullmatch(stem)
+            if m is None:
+                append((relpath, None, None, ext))
             else:
-                item = None
-                seq = None
+                item, seq = m.group('item', 'seq')
+                append((relpath, item, None if seq is None else int(seq), ext))
+        return records
+
+    def classify_all(self, relpaths, batch_size=4096, metrics=NULL):
+        """ Yields records for an iterable of paths, classifying them in
+            batches. """
+        relpaths = iter(relpaths)
+        while batch := list(islice(relpaths, batch_size)):
+            with metrics.timed('classify', 'files') as stage:
+                records = self.classify_batch(batch)
+                stage.count += len(records)
+            yield from records
+
+
+CLASSIFIERS = {'default': Classifier()}
+
+
+def register_classifier(name, classifier):
+    """ Makes a naming convention available to FileSet by name. Conventions can
+        also be registered by other packages through the 'dctools.classifiers'
+        entry point group. """
+    CLASSIFIERS[name] = classifier
+
+
+def get_classifier(name):
+    if name not in CLASSIFIERS:
+        # Imported here, as importlib.metadata is slow to import and is only
+        # needed for conventions that are not already registered.
+        from importlib.metadata import entry_points
+        for ep in entry_points(group='dctools.classifiers', name=name):
+            register_classifier(name, ep.load())
+    try:
+        return CLASSIFIERS[name]
+    except KeyError:
+        raise ValueError(f"No file naming convention named {name!r}")
+
+
+class File:
+    """ A view of one record in a FileSet. The record itself is held in the
+        set's columns; attributes are looked up from them on access, and the
+        relative path becomes a Path object only when relpath is read. """
+
+    __slots__ = ('fileset', 'n')
+
+    def __init__(self, fileset, n):
+        self.fileset = fileset
+        self.n = n
+
+    @property
+    def path(self):
+        return self.fileset.paths[self.n]
+
+    @property
+    def relpath(self):
+        return Path(self.fileset.paths[self.n])
+
+    @property
+    def base(self):
+        ext = self.ext
+        name = self.path.rpartition(os.sep)[2]
+        return name[:-len(ext)] if ext else name
+
+    @property
+    def item(self):
+        code = self.fileset.items[self.n]
+        return self.fileset.item_ids[code] if code >= 0 else None
+
+    @property
+    def seq(self):
+        seq = self.fileset.seqs[self.n]
+        return seq if seq >= 0 else None
+
+    @property
+    def ext(self):
+        return self.fileset.ext_names[self.fileset.exts[self.n]]
+
+    @property
+    def usage(self):
+        fileset = self.fileset
+        return fileset.usage_names[fileset.ext_usages[fileset.exts[self.n]]]
+
+    @property
+    def size(self):
+        sizes = self.fileset.sizes
+        return sizes[self.n] if self.n < len(sizes) else None
+
+    @property
+    def mtime(self):
+        mtimes = self.fileset.mtimes
+        return mtimes[self.n] if self.n < len(mtimes) else None
+
+    def record(self):
+        return (self.path, self.item, self.seq, self.ext)
+
+    def sort_key(self):
+        return self.path.split(os.sep)
+
+    def __eq__(self, other):
+        if not isinstance(other, File):
+            return NotImplemented
+        return self.record() == other.record()
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+    def __repr__(self):
+        return (f"File(relpath={self.path!r}, item={self.item!r}, "
+                f"seq={self.seq!r}, ext={self.ext!r})")
+
+
+class ItemIndex:
+    """ The record numbers of a single item's files: its members ordered by
+        sequence number and its item-level files. """
+
+    def __init__(self):
+        self.members = array('i')
+        self.seqs = array('i')
+        self.item_level = array('i')
+
+    def sort(self, fileset):
+        paths, seqs = fileset.paths, fileset.seqs
+        self.members = array('i', sorted(
+            self.members, key=lambda n: (seqs[n], paths[n].split(os.sep))
+            ))
+        self.seqs = array('i', (seqs[n] for n in self.members))
+        self.item_level = array('i', sorted(
+            self.item_level, key=lambda n: paths[n].split(os.sep)
+            ))
+
+    def get_range(self, start=None, limit=None):
+        """ Returns the member record numbers with start <= seq < limit, where
+            either bound may be omitted. """
+        lo = 0 if start is None else bisect_left(self.seqs, start)
+        hi = len(self.seqs) if limit is None else bisect_left(self.seqs, limit)
+        return self.members[lo:hi]
+
+
+class Partition:
+    """ The member files of a FileSet divided among metadata rows, each row
+        taking the half-open interval of sequence numbers from its own start
+        to the next start of the same item, so that every member file of a
+        described item belongs to at most one row. Identifiers are of the
+        form item, for a whole item (which starts before its first page), or
+        item-seq, for the part of an item starting at seq. The members of a
+        described item before its first start are orphans. Rows that claim
+        the same start, or a whole item that is also described in parts, are
+        reported in overlaps as (identifier, identifier) pairs, and the files
+        both claim go to the later of each pair. """
+
+    def __init__(self, fileset, identifiers):
+        self.fileset = fileset
+        self.ranges = {}
+        self.orphans = array('i')
+        self.overlaps = []
+        starts = {}
+        seen = set()
+        for identifier in sorted(identifiers):
+            if identifier in seen:
+                self.overlaps.append((identifier, identifier))
+                continue
+            seen.add(identifier)
+            parts = identifier.split('-')
             try:
-                usage = self.use_ext[f.suffix]
-            except KeyError:
-                usage = None
-            self.contents.add(
-                self.File(relpath = f.relative_to(root),
-                          base = f.stem,
-                          item = item,
-                          ext = f.suffix,
-                          seq = seq,
-                          usage = usage
-                          )
-                )
+                if len(parts) == 2:
+                    start = -1
+                elif len(parts) == 3:
+                    start = int(parts[2])
+                else:
+                    continue
+            except ValueError:
+                continue
+            item = "-".join(parts[:2])
+            starts.setdefault(item, []).append((start, identifier))
+        for item, rows in starts.items():
+            self.divide(item, sorted(rows))
+
+    def divide(self, item, rows):
+        """ Assigns the members of item to its rows, which are sorted
+            (start, identifier) pairs. """
+        entry = self.fileset.index.get(item)
+        if entry is None:
+            return
+        for (start, identifier), (next_start, next_identifier) in zip(
+                rows, rows[1:]):
+            if start == next_start or start == -1:
+                self.overlaps.append((identifier, next_identifier))
+        bounds = [bisect_left(entry.seqs, start) for start, _ in rows]
+        self.orphans.extend(entry.members[:bounds[0]])
+        for (_, identifier), lo, hi in zip(rows, bounds,
+                                           bounds[1:] + [len(entry.seqs)]):
+            self.ranges[identifier] = (entry, lo, hi)
+
+    def get_members(self, identifier):
+        """ Returns the member files assigned to the row identified by
+            identifier, in sequence order. """
+        if identifier not in self.ranges:
+            return []
+        entry, lo, hi = self.ranges[identifier]
+        return self.fileset.files(entry.members[lo:hi])
+
+    def orphan_pages(self):
+        """ The sorted identifiers of the pages with orphaned files. """
+        return sorted({f.base for f in self.fileset.files(self.orphans)})
+
+
+class BestImages(Mapping):
+    """ The best images of every item in a FileSet, keyed by item id. choices
+        holds, for each item code, the position in IMAGE_EXTS of the
+        extension that covers all of the item's pages, or -1 where none does.
+        An item's files are selected only when it is looked up, leaving out
+        the rejected file numbers. """
+
+    def __init__(self, fileset, choices, rejected=frozenset()):
+        self.fileset = fileset
+        self.choices = choices
+        self.rejected = rejected
+
+    def __getitem__(self, item):
+        fileset = self.fileset
+        code = fileset.item_codes[item]
+        choice = self.choices[code]
+        chosen = IMAGE_EXTS[choice] if choice >= 0 else None
+        exts, names, rejected = fileset.exts, fileset.ext_names, self.rejected
+        return fileset.files(
+            n for n in fileset.index[item].members
+            if (names[exts[n]] == chosen and n not in rejected)
+            or names[exts[n]] not in IMAGE_EXTS
+            )
 
     def __iter__(self):
-        return iter(self.contents)
+        return iter(self.fileset.item_ids)
 
     def __len__(self):
-        return len(self.contents)
+        return len(self.fileset.item_ids)
+
+    @property
+    def incomplete(self):
+        """ The sorted ids of the items with no complete set of images. """
+        return sorted(self.fileset.item_ids[code]
+                      for code, choice in enumerate(self.choices) if choice < 0)
+
+
+class FileSet(Collection):
+    """ The classified files below a root directory, stored column-wise: paths
+        as strings, item ids and extensions as codes into interned tables, and
+        sequence numbers (-1 for none) in a typed array. Sizes and mtimes (in
+        ns) are held in two more arrays when the set was crawled by an
+        AsyncCrawler or stat_files was called, and are otherwise empty. Fixity
+        digests made by fixity.compute_digests are held in digests, and the
+        outcomes of ocr.check_sidecars in ocr and the probes made by
+        images.probe_images in probes, all keyed by path. """
+
+    File = File
+
+    def __init__(self, root, workers=DEFAULT_WORKERS, manifest=None,
+                 records=None, classifier='default', metrics=NULL,
+                 scan=scan_dir, crawler=None):
+        """ Crawls root, listing each directory with scan, or refreshes it from
+            a manifest when one is supplied. Already classified records can be
+            passed instead to skip the crawl. An aiocrawl.AsyncCrawler can be
+            supplied to crawl with many calls in flight, for network storage,
+            which also records the size and mtime of each file; it is not used
+            to refresh a manifest. The classifier is a Classifier or the name
+            of a registered one. The crawl and index stages are recorded in
+            metrics. """
+        self.root = root
+        if isinstance(classifier, str):
+            classifier = get_classifier(classifier)
+        self.classifier = classifier
+        self.paths = []
+        self.items = array('i')
+        self.seqs = array('i')
+        self.exts = array('i')
+        self.item_ids = []
+        self.item_codes = {}
+        self.ext_names = []
+        self.ext_codes = {}
+        self.ext_usages = []
+        self.usage_names = [None]
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.digests = {}
+        self.ocr = {}
+        self.probes = {}
+        if records is None and manifest is None and crawler is not None:
+            records = self.classify_stats(crawler.crawl(root), metrics)
+        elif records is None and manifest is None:
+            records = classifier.classify_all(scan_tree(root, workers, scan),
+                                              metrics=metrics)
+        elif records is None:
+            records = manifest.refresh(self, workers)
+        with metrics.timed('crawl', 'files'):
+            for record in metrics.counted('crawl', records, 'files'):
+                self.append(record)
+        with metrics.timed('index', 'items') as stage:
+            self.build_index()
+            stage.count += len(self.index)
+
+    def classify(self, relpath):
+        """ Returns the (relpath, item, seq, ext) record for a path relative to
+            the root. """
+        return self.classifier.classify_batch([relpath])[0]
+
+    def classify_stats(self, batches, metrics=NULL):
+        """ Yields the records for batches of (relpath, size, mtime) stats,
+            adding each file's size and mtime to the columns as its record is
+            yielded to be appended. """
+        for batch in batches:
+            with metrics.timed('classify', 'files') as stage:
+                records = self.classifier.classify_batch(
+                    [relpath for relpath, _, _ in batch]
+                    )
+                stage.count += len(records)
+            for record, (_, size, mtime) in zip(records, batch):
+                self.sizes.append(size)
+                self.mtimes.append(mtime)
+                yield record
+
+    def append(self, record):
+        """ Adds a (relpath, item, seq, ext) record to the columns, interning its
+            item id and extension. """
+        relpath, item, seq, ext = record
+        if item is None:
+            item_code = -1
+        else:
+            item_code = self.item_codes.get(item)
+            if item_code is None:
+                item_code = self.item_codes[item] = len(self.item_ids)
+                self.item_ids.append(item)
+        ext_code = self.ext_codes.get(ext)
+        if ext_code is None:
+            ext_code = self.ext_codes[ext] = len(self.ext_names)
+            self.ext_names.append(ext)
+            usage = self.classifier.usage(ext)
+            if usage not in self.usage_names:
+                self.usage_names.append(usage)
+            self.ext_usages.append(self.usage_names.index(usage))
+        self.paths.append(relpath)
+        self.items.append(item_code)
+        self.seqs.append(-1 if seq is None else seq)
+        self.exts.append(ext_code)
+
+    def stat_files(self, workers=DEFAULT_WORKERS, batch_size=1024):
+        """ Fills in the sizes and mtimes of the files, unless the crawl
+            recorded them, statting batches of files in a pool of worker
+            threads. A file that can no longer be statted gets -1 for both.
+            Returns the number of files statted. """
+        if len(self.sizes) == len(self):
+            return 0
+        root = self.root
+
+        def stat_batch(paths):
+            stats = []
+            for path in paths:
+                try:
+                    stat = os.stat(os.path.join(root, path))
+                    stats.append((stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    stats.append((-1, -1))
+            return stats
+
+        paths = iter(self.paths)
+        batches = iter(lambda: list(islice(paths, batch_size)), [])
+        sizes, mtimes = array('q'), array('q')
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for stats in pool.map(stat_batch, batches):
+                for size, mtime in stats:
+                    sizes.append(size)
+                    mtimes.append(mtime)
+        self.sizes, self.mtimes = sizes, mtimes
+        return len(self)
+
+    def build_index(self):
+        """ Groups the records by item so that lookups do not scan the set. """
+        entries = [ItemIndex() for _ in self.item_ids]
+        for n, (item_code, seq) in enumerate(zip(self.items, self.seqs)):
+            if item_code >= 0:
+                entry = entries[item_code]
+                if seq >= 0:
+                    entry.members.append(n)
+                else:
+                    entry.item_level.append(n)
+        for entry in entries:
+            entry.sort(self)
+        self.index = dict(zip(self.item_ids, entries))
+
+    def files(self, numbers):
+        return [File(self, n) for n in numbers]
+
+    def __iter__(self):
+        return (File(self, n) for n in range(len(self.paths)))
+
+    def __len__(self):
+        return len(self.paths)
 
     def __contains__(self, other):
-        if other in self.contents:
+        if not isinstance(other, File):
+            return False
+        if other.fileset is self:
             return True
+        entry = self.index.get(other.item)
+        if entry is None:
+            candidates = range(len(self.paths))
+        elif other.seq is None:
+            candidates = entry.item_level
         else:
-            return False
+            candidates = entry.get_range(other.seq, other.seq + 1)
+        record = other.record()
+        return any(File(self, n).record() == record for n in candidates)
+
+    def count_table(self, exts=('.tif', '.hocr', '.xml')):
+        """ Returns the file counts of the whole set as a table of columns,
+            with a row for each page and for each item's item-level files.
+            'item' and 'seq' (-1 for item-level files) identify the rows, which
+            are sorted by both; 'files' counts all of a row's files and each
+            extension in exts has a column of its own. The counts are made
+            with NumPy where it is installed, and the columns are then NumPy
+            arrays that can be passed straight to pandas.DataFrame. """
+        try:
+            import numpy
+        except ImportError:
+            return self._count_table(exts)
+        codes = [self.ext_codes.get(ext, -1) for ext in exts]
+        items = numpy.frombuffer(self.items, dtype=numpy.intc)
+        seqs = numpy.frombuffer(self.seqs, dtype=numpy.intc)
+        ext_codes = numpy.frombuffer(self.exts, dtype=numpy.intc)
+        keep = items >= 0
+        rank = numpy.empty(len(self.item_ids), dtype=numpy.int64)
+        rank[numpy.argsort(numpy.array(self.item_ids, dtype=object))] = (
+            numpy.arange(len(self.item_ids))
+            )
+        keys = (rank[items[keep]] << 32) | (seqs[keep].astype(numpy.int64) + 1)
+        groups, rows = numpy.unique(keys, return_inverse=True)
+        order = numpy.argsort(rank)
+        table = {
+            'item': numpy.array(self.item_ids, dtype=object)[
+                order[groups >> 32]
+                ],
+            'seq': (groups & 0xFFFFFFFF) - 1,
+            'files': numpy.bincount(rows, minlength=len(groups)),
+            }
+        for ext, code in zip(exts, codes):
+            table[ext] = numpy.bincount(
+                rows[ext_codes[keep] == code], minlength=len(groups)
+                )
+        return table
+
+    def _count_table(self, exts):
+        counts = Counter(zip(self.items, self.seqs, self.exts))
+        groups = {}
+        for (item, seq, ext), n in counts.items():
+            if item >= 0:
+                groups.setdefault((self.item_ids[item], seq), Counter())[ext] = n
+        codes = [self.ext_codes.get(ext, -1) for ext in exts]
+        keys = sorted(groups)
+        table = {
+            'item': [item for item, _ in keys],
+            'seq': array('i', (seq for _, seq in keys)),
+            'files': array('i', (sum(groups[k].values()) for k in keys)),
+            }
+        for ext, code in zip(exts, codes):
+            table[ext] = array('i', (groups[k][code] for k in keys))
+        return table
 
-    def as_object_tree(self):
-        results = []
-        for f in self.contents:
-            item = Item.from_registry(f.item)
+    def as_object_tree(self, registry):
+        """ Builds the archelon Items and Pages for the set in registry and
+            returns the Items. Files not named for an item, such as Thumbs.db,
+            are left out. """
+        for f in self:
+            if f.item is None:
+                continue
+            item = Item.from_registry(f.item, registry)
             if f.seq is not None:
-                page = Page.from_registry(f.base)
-                page.files.append(f)
-                if page not in item.pages:
-                    item.pages.append(page)
-            if item not in results:
-                results.append(item)
-        return results
-
-    def get_best_images(self, item_files):
+                page = Page.from_registry(f.base, registry)
+                page.add_file(f)
+                item.pages.add(page)
+            else:
+                item.add_file(f)
+        return registry.values(Item)
+
+    def get_best_images(self, item_files, probes=None):
         ''' Given a set of item-level files, return all tiffs or all jpegs plus 
-            all ancillary files. '''
+            all ancillary files. Images whose probe in probes failed are left
+            out, so that a page with a broken tiff falls back to jpegs. '''
+        rejected = self.rejected_paths(probes)
         all_pages = set([f.base for f in item_files])
-        tiffs = set([f for f in item_files if f.ext == '.tif'])
-        jpegs = set([f for f in item_files if f.ext == '.jpg'])
+        tiffs = set([f for f in item_files
+                     if f.ext == '.tif' and f.path not in rejected])
+        jpegs = set([f for f in item_files
+                     if f.ext == '.jpg' and f.path not in rejected])
         non_image = set([f for f in item_files if f.ext not in ['.tif', '.jpg']])
         if set([f.base for f in tiffs]) == all_pages:
             return tiffs.union(non_image)
@@ -85,30 +622,94 @@ class FileSet(Collection):
         else:
             return non_image
 
+    def rejected_paths(self, probes):
+        """ The paths of the images whose probe in probes failed. """
+        return {path for path, probe in (probes or {}).items() if not probe.ok}
+
+    def best_images(self, probes=None):
+        """ Selects the best images of every item at once, as get_best_images
+            does for one: all TIFFs if every page has one, else all JPEGs if
+            every page has one, along with the non-image files, leaving out
+            images whose probe in probes failed. The pages of each item that
+            have each image format are counted in a single grouped pass, with
+            NumPy where it is installed. Returns a BestImages mapping from item
+            id to the selected member files. """
+        exts, rejected = self.exts, frozenset()
+        if paths := self.rejected_paths(probes):
+            rejected = frozenset(
+                n for n, path in enumerate(self.paths) if path in paths
+                )
+            # A rejected image counts toward its page but not its format,
+            # as its extension code is replaced by one that matches none.
+            exts = array('i', exts)
+            for n in rejected:
+                exts[n] = -2
+        try:
+            import numpy
+        except ImportError:
+            return BestImages(self, self._best_image_choices(exts), rejected)
+        items = numpy.frombuffer(self.items, dtype=numpy.intc)
+        seqs = numpy.frombuffer(self.seqs, dtype=numpy.intc)
+        exts = numpy.frombuffer(exts, dtype=numpy.intc)
+        members = (items >= 0) & (seqs >= 0)
+        keys = (items[members].astype(numpy.int64) << 32) | seqs[members]
+        exts = exts[members]
+
+        def pages(keys):
+            return numpy.bincount(numpy.unique(keys) >> 32,
+                                  minlength=len(self.item_ids))
+
+        all_pages = pages(keys)
+        choices = numpy.full(len(self.item_ids), -1, dtype=numpy.intc)
+        for choice in reversed(range(len(IMAGE_EXTS))):
+            code = self.ext_codes.get(IMAGE_EXTS[choice], -1)
+            choices[pages(keys[exts == code]) == all_pages] = choice
+        return BestImages(self, array('i', choices.tobytes()), rejected)
+
+    def _best_image_choices(self, exts):
+        pages = {}
+        covered = [Counter() for _ in IMAGE_EXTS]
+        codes = {self.ext_codes.get(ext, -1): n for n, ext in enumerate(IMAGE_EXTS)}
+        for key in set(zip(self.items, self.seqs, exts)):
+            item, seq, ext = key
+            if item >= 0 and seq >= 0:
+                pages.setdefault(item, set()).add(seq)
+                if ext in codes:
+                    covered[codes[ext]][item] += 1
+        choices = array('i', [-1] * len(self.item_ids))
+        for item in range(len(self.item_ids)):
+            total = len(pages.get(item, ()))
+            for choice, counts in enumerate(covered):
+                if counts[item] == total:
+                    choices[item] = choice
+                    break
+        return choices
+
+    def partition(self, identifiers):
+        """ Divides the member files among the rows of a batch in one pass
+            over their sorted identifiers, returning a Partition. """
+        return Partition(self, identifiers)
+
     def get_members(self, id, next_id=None):
+        """ Returns the member files of the item (or the part of a split item)
+            identified by id, in sequence order. """
         parts = id.split('-')
         if len(parts) == 2:
-            files = sorted(
-                [f for f in self.contents if f.item == id and f.seq is not None]
-                )
+            entry = self.index.get(id)
+            return self.files(entry.get_range()) if entry else []
         elif len(parts) == 3:
             id = "-".join(parts[:2])
+            entry = self.index.get(id)
+            if entry is None:
+                return []
             start = int(parts[2])
-            if "-".join(next_id.split('-')[:2]) != id:
-                files = sorted(
-                    [f for f in self.contents if f.item == id and f.seq >= start]
-                    )
-            elif next_id is not None:
-                limit = int(next_id.split('-')[2])
-                page_range = [i for i in range(start, limit)]
-                files = sorted(
-                    [f for f in self.contents if f.item == id and f.seq in page_range]
-                    )
+            next_parts = next_id.split('-') if next_id else []
+            if len(next_parts) == 3 and "-".join(next_parts[:2]) == id:
+                return self.files(entry.get_range(start, int(next_parts[2])))
             else:
-                files = []
-        return files
+                return self.files(entry.get_range(start))
+        return []
 
     def get_item_level(self, item):
-        return [
-            str(f.relpath) for f in self.contents if f.item == item and f.seq is None
-            ]
+        entry = self.index.get(item)
+        return [self.paths[n] for n in entry.item_level] if entry else []
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+""" The dctools command, which gathers the toolkit's commands as subcommands.
+    Each subcommand's module is imported only when that subcommand is run (or
+    listed by --help), so that starting one command does not pay for the
+    imports of the others. """
+
+from importlib import import_module
+
+import click
+
+
+SUBCOMMANDS = {
+    'hello': 'dctools.hello:cli',
+    'merge': 'dctools.validate:merge',
+    'populate': 'dctools.populate:populate',
+    'validate': 'dctools.validate:validate',
+    }
+
+
+class LazyGroup(click.Group):
+    """ A command group whose subcommands are named by 'module:attribute'
+        strings and imported when first looked up. """
+
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) |
+                      set(self.lazy_subcommands))
+
+    def get_command(self, ctx, name):
+        if name in self.lazy_subcommands and name not in self.commands:
+            module, attribute = self.lazy_subcommands[name].split(':')
+            self.add_command(getattr(import_module(module), attribute), name)
+        return super().get_command(ctx, name)
+
+
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS)
+def cli():
+    """ Tools for working with digital collections data. """
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,142 @@
+""" Computes fixity digests for the files of a FileSet, reusing digests saved
+    for files whose size and mtime have not changed. """
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import islice
+import os
+from threading import Lock
+import time
+
+try:
+    from .manifest import PathCache, cache_home
+except ImportError:
+    from manifest import PathCache, cache_home
+
+
+ALGORITHMS = ('md5', 'sha256')
+
+CHUNK_SIZE = 8 * 2**20
+
+DEFAULT_WORKERS = 4
+
+
+def default_cache_path():
+    return cache_home() / 'digests.sqlite'
+
+
+class Throttle:
+    """ Limits the combined rate at which threads read, in bytes per second. """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = Lock()
+        self.next = time.monotonic()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class DigestCache(PathCache):
+    """ Digests saved by absolute path along with the size and mtime the file
+        had when it was read. """
+
+    table = 'digests'
+    columns = """
+        path TEXT, alg TEXT, size INTEGER, mtime INTEGER, digest TEXT,
+        PRIMARY KEY (path, alg)
+        """
+
+    def __init__(self, path=None):
+        super().__init__(path or default_cache_path())
+
+    def load(self, root):
+        """ Returns the saved digests of the files below root, keyed by path
+            and algorithm. """
+        return {(path, alg): (size, mtime, digest)
+                for path, alg, size, mtime, digest in self.select(root)}
+
+    def save(self, entries):
+        """ Saves (path, alg, size, mtime, digest) entries. """
+        self.insert(entries)
+
+
+def hash_file(path, algorithms=ALGORITHMS[:1], chunk_size=CHUNK_SIZE,
+              throttle=None):
+    """ Reads the file at path in chunks and returns its digests as a dict
+        keyed by algorithm. """
+    hashers = [hashlib.new(alg) for alg in algorithms]
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as handle:
+        while size := handle.readinto(buffer):
+            if throttle is not None:
+                throttle.consume(size)
+            for hasher in hashers:
+                hasher.update(view[:size])
+    return {alg: h.hexdigest() for alg, h in zip(algorithms, hashers)}
+
+
+def compute_digests(fileset, algorithms=ALGORITHMS[:1], workers=DEFAULT_WORKERS,
+                    cache=None, rate=None, chunk_size=CHUNK_SIZE):
+    """ Sets fileset.digests to a dict giving the digests of each file, keyed
+        by relative path and then by algorithm. Files are hashed in a pool of
+        threads, at no more than rate bytes per second in total when a rate is
+        given. Digests in the cache for a file of the same size and mtime are
+        used instead of reading the file, and new digests are saved to it
+        after each batch of files.
+        Sizes and mtimes recorded by the crawl are used where the fileset has
+        them, rather than statting each file again. Returns the number of
+        files that were read. """
+    root = os.path.abspath(fileset.root)
+    saved = cache.load(root) if cache is not None else {}
+    throttle = Throttle(rate) if rate else None
+
+    stats = len(fileset.sizes) == len(fileset)
+
+    def digest(n):
+        relpath = fileset.paths[n]
+        path = os.path.join(root, relpath)
+        if stats:
+            size, mtime = fileset.sizes[n], fileset.mtimes[n]
+        else:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return relpath, {}, []
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        found = {}
+        for alg in algorithms:
+            entry = saved.get((path, alg))
+            if entry is not None and entry[:2] == (size, mtime):
+                found[alg] = entry[2]
+        if len(found) == len(algorithms):
+            return relpath, found, []
+        try:
+            found = hash_file(path, algorithms, chunk_size, throttle)
+        except OSError:
+            return relpath, {}, []
+        return relpath, found, [
+            (path, alg, size, mtime, value) for alg, value in found.items()
+            ]
+
+    fileset.digests = {}
+    read = 0
+    numbers = iter(range(len(fileset)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while batch := list(islice(numbers, workers * 64)):
+            entries = []
+            for relpath, found, fresh in pool.map(digest, batch):
+                fileset.digests[relpath] = found
+                entries.extend(fresh)
+            # Saved batch by batch so that an interrupted run keeps the
+            # digests it has made.
+            if cache is not None and entries:
+                cache.save(entries)
+            read += len(entries) // len(algorithms)
+    return read
@@ -0,0 +1,290 @@
+""" Probes TIFF and JPEG page images by reading their headers, without decoding
+    them, for their format, dimensions, bit depth and compression, and to catch
+    empty, truncated or mislabelled files. Results are cached by the size and
+    mtime of each file. """
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
+import struct
+
+try:
+    from .manifest import PathCache, cache_home
+except ImportError:
+    from manifest import PathCache, cache_home
+
+
+DEFAULT_WORKERS = 8
+
+HEAD_SIZE = 8192
+
+FORMATS = {'.tif': 'tiff', '.tiff': 'tiff', '.jpg': 'jpeg', '.jpeg': 'jpeg'}
+
+# The outcomes of a probe.
+OK = 'ok'
+EMPTY = 'empty'
+UNREADABLE = 'unreadable'
+WRONG_FORMAT = 'wrong_format'
+MALFORMED = 'malformed'
+TRUNCATED = 'truncated'
+
+TIFF_COMPRESSION = {
+    1: 'none', 2: 'ccitt_rle', 3: 'ccitt_g3', 4: 'ccitt_g4', 5: 'lzw',
+    6: 'ojpeg', 7: 'jpeg', 8: 'deflate', 32773: 'packbits', 32946: 'deflate',
+    34712: 'jpeg2000', 50000: 'zstd',
+    }
+
+# Struct codes of the TIFF field types holding unsigned integers.
+TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+
+JPEG_SOF = {
+    0xC0: 'baseline', 0xC1: 'extended', 0xC2: 'progressive', 0xC3: 'lossless',
+    0xC5: 'differential', 0xC6: 'differential_progressive',
+    0xC7: 'differential_lossless', 0xC9: 'arithmetic',
+    0xCA: 'arithmetic_progressive', 0xCB: 'arithmetic_lossless',
+    0xCD: 'arithmetic_differential',
+    0xCE: 'arithmetic_differential_progressive',
+    0xCF: 'arithmetic_differential_lossless',
+    }
+
+
+class Probe(namedtuple('Probe', ['status', 'format', 'width', 'height',
+                                 'bits', 'samples', 'compression'])):
+    """ The outcome of probing an image, with what its header gave of its
+        format, dimensions (in pixels), bits per sample, samples per pixel
+        and compression. """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+    def describe(self):
+        if self.width is None:
+            return self.format or ""
+        return (f"{self.format} {self.width}x{self.height} "
+                f"{self.samples}x{self.bits}-bit {self.compression}")
+
+
+def failed(status, format=None):
+    return Probe(status, format, None, None, None, None, None)
+
+
+class Truncated(Exception):
+    pass
+
+
+class Malformed(Exception):
+    pass
+
+
+class Header:
+    """ Reads byte ranges of an open file. Ranges within its first HEAD_SIZE
+        bytes come from a single read; others cost a seek and a read of
+        their own. A range past the end of the file raises Truncated. """
+
+    def __init__(self, handle, size):
+        self.handle = handle
+        self.size = size
+        self.head = handle.read(HEAD_SIZE)
+
+    def read(self, offset, length):
+        if offset + length > self.size:
+            raise Truncated()
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+        self.handle.seek(offset)
+        data = self.handle.read(length)
+        if len(data) < length:
+            raise Truncated()
+        return data
+
+
+def probe_tiff(header):
+    order = '<' if header.head[:2] == b'II' else '>'
+    version, = struct.unpack(order + 'H', header.read(2, 2))
+    if version == 42:
+        offset, = struct.unpack(order + 'I', header.read(4, 4))
+        count_code, entry_size, value_size = 'H', 12, 4
+    elif version == 43:
+        offset, = struct.unpack(order + 'Q', header.read(8, 8))
+        count_code, entry_size, value_size = 'Q', 20, 8
+    else:
+        raise Malformed()
+    count_size = struct.calcsize(count_code)
+    entries, = struct.unpack(order + count_code, header.read(offset, count_size))
+    ifd = header.read(offset + count_size, entries * entry_size)
+    entry_code = order + 'HH' + ('I' if version == 42 else 'Q')
+
+    fields = {}
+    for n in range(entries):
+        entry = ifd[n * entry_size:(n + 1) * entry_size]
+        tag, type, count = struct.unpack_from(entry_code, entry)
+        code = TIFF_TYPES.get(type)
+        if code is None or tag not in (256, 257, 258, 259, 273, 277, 279,
+                                       324, 325):
+            continue
+        if count == 0:
+            raise Malformed()
+        length = count * struct.calcsize(code)
+        if length <= value_size:
+            data = entry[entry_size - value_size:][:length]
+        else:
+            pointer, = struct.unpack_from(
+                order + ('I' if version == 42 else 'Q'),
+                entry, entry_size - value_size
+                )
+            data = header.read(pointer, length)
+        fields[tag] = struct.unpack(f"{order}{count}{code}", data)
+
+    if 256 not in fields or 257 not in fields:
+        raise Malformed()
+    offsets = fields.get(273, fields.get(324))
+    lengths = fields.get(279, fields.get(325))
+    if offsets is None or lengths is None:
+        raise Malformed()
+    if max(o + n for o, n in zip(offsets, lengths)) > header.size:
+        raise Truncated()
+    compression = fields.get(259, (1,))[0]
+    return Probe(OK, 'tiff', fields[256][0], fields[257][0],
+                 fields.get(258, (1,))[0], fields.get(277, (1,))[0],
+                 TIFF_COMPRESSION.get(compression, str(compression)))
+
+
+def probe_jpeg(header):
+    position = 2
+    while True:
+        marker = header.read(position, 2)
+        if marker[0] != 0xFF:
+            raise Malformed()
+        code = marker[1]
+        if code == 0xFF:
+            position += 1
+        elif code == 0x01 or 0xD0 <= code <= 0xD8:
+            position += 2
+        elif code in (0xD9, 0xDA):
+            # End of image, or start of scan, before any frame header
+            raise Malformed()
+        else:
+            length, = struct.unpack('>H', header.read(position + 2, 2))
+            if code in JPEG_SOF:
+                bits, height, width, samples = struct.unpack(
+                    '>BHHB', header.read(position + 4, 6)
+                    )
+                break
+            position += 2 + length
+    # A complete file ends with the end of image marker, which some writers
+    # follow with padding.
+    tail = header.read(max(0, header.size - 64), min(64, header.size))
+    if b'\xff\xd9' not in tail:
+        raise Truncated()
+    return Probe(OK, 'jpeg', width, height, bits, samples, JPEG_SOF[code])
+
+
+def probe_image(path, ext=None):
+    """ Probes the image at path, which is expected to be in the format its
+        extension (or ext) implies. """
+    expected = FORMATS.get((ext or os.path.splitext(path)[1]).lower())
+    try:
+        with open(path, 'rb') as handle:
+            size = os.fstat(handle.fileno()).st_size
+            if size == 0:
+                return failed(EMPTY)
+            header = Header(handle, size)
+            if header.head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00',
+                                   b'MM\x00+'):
+                format, probe = 'tiff', probe_tiff
+            elif header.head[:2] == b'\xff\xd8':
+                format, probe = 'jpeg', probe_jpeg
+            else:
+                return failed(WRONG_FORMAT)
+            if expected is not None and format != expected:
+                return failed(WRONG_FORMAT, format)
+            try:
+                return probe(header)
+            except Truncated:
+                return failed(TRUNCATED, format)
+            except (Malformed, struct.error, ValueError, IndexError):
+                return failed(MALFORMED, format)
+    except OSError:
+        return failed(UNREADABLE)
+
+
+def default_cache_path():
+    return cache_home() / 'probes.sqlite'
+
+
+class ProbeCache(PathCache):
+    """ Probes saved by absolute path along with the size and mtime the file
+        had when it was probed. """
+
+    table = 'probes'
+    columns = """
+        path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+        status TEXT, format TEXT, width INTEGER, height INTEGER,
+        bits INTEGER, samples INTEGER, compression TEXT
+        """
+
+    def __init__(self, path=None):
+        super().__init__(path or default_cache_path())
+
+    def load(self, root):
+        """ Returns the saved probes of the files below root, keyed by path, as
+            (size, mtime, Probe) tuples. """
+        return {path: (size, mtime, Probe(*fields))
+                for path, size, mtime, *fields in self.select(root)}
+
+    def save(self, entries):
+        """ Saves (path, size, mtime, Probe) entries. """
+        self.insert((path, size, mtime, *probe)
+                    for path, size, mtime, probe in entries)
+
+
+def probe_images(fileset, workers=DEFAULT_WORKERS, cache=None):
+    """ Sets fileset.probes to a dict giving the Probe of each TIFF and JPEG
+        file, keyed by relative path. Files are probed in a pool of threads,
+        except those with a saved probe in the cache for the same size and
+        mtime; new probes are saved to it after each batch of files. Sizes and
+        mtimes recorded by the crawl are used where the fileset has them.
+        Returns the number of files that were read. """
+    root = os.path.abspath(fileset.root)
+    saved = cache.load(root) if cache is not None else {}
+    stats = len(fileset.sizes) == len(fileset)
+
+    def probe(n):
+        relpath = fileset.paths[n]
+        path = os.path.join(root, relpath)
+        if stats:
+            size, mtime = fileset.sizes[n], fileset.mtimes[n]
+        else:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return relpath, failed(UNREADABLE), None
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        entry = saved.get(path)
+        if entry is not None and entry[:2] == (size, mtime):
+            return relpath, entry[2], None
+        result = probe_image(path)
+        return relpath, result, (path, size, mtime, result)
+
+    codes = {code for ext, code in fileset.ext_codes.items()
+             if ext.lower() in FORMATS}
+    numbers = iter([n for n, code in enumerate(fileset.exts) if code in codes])
+    fileset.probes = {}
+    read = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while batch := list(islice(numbers, workers * 64)):
+            entries = []
+            for relpath, result, fresh in pool.map(probe, batch):
+                fileset.probes[relpath] = result
+                if fresh is not None:
+                    entries.append(fresh)
+            # Saved batch by batch so that an interrupted run keeps the
+            # probes it has made.
+            if cache is not None and entries:
+                cache.save(entries)
+            read += len(entries)
+    return read
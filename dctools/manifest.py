@@ -0,0 +1,196 @@
+from collections import namedtuple
+from contextlib import closing
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time
+
+try:
+    from .binaries import DEFAULT_WORKERS, scan_dir, scan_tree
+except ImportError:
+    from binaries import DEFAULT_WORKERS, scan_dir, scan_tree
+
+
+# Directories modified this recently are listed again on the next run (or
+# check, when watching), since a change in the same clock tick as the listing
+# would not alter the stored mtime.
+SETTLE_NS = 2_000_000_000
+
+SCHEMA_VERSION = 2
+
+
+def cache_home():
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'dctools'
+
+
+def default_cache_dir():
+    return cache_home() / 'manifests'
+
+
+class PathCache:
+    """ A table of entries saved by the absolute paths of files, such as the
+        digests or probes of files along with the size and mtime each had.
+        Subclasses name the table and give its columns, the first of which
+        is the path. """
+
+    table = None
+    columns = None
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ({self.columns})"
+            )
+        return conn
+
+    def select(self, root):
+        """ Returns the rows saved for the files below root. """
+        prefix = os.path.join(os.path.abspath(root), '')
+        # Every path starting with prefix sorts before this one.
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                f"SELECT * FROM {self.table} WHERE path >= ? AND path < ?",
+                (prefix, upper)).fetchall()
+
+    def insert(self, rows):
+        """ Saves rows, replacing any with the same key. """
+        rows = list(rows)
+        if not rows:
+            return
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES "
+                f"({', '.join('?' * len(rows[0]))})", rows
+                )
+
+
+def list_dir(root, reldir, started=None, cached=None):
+    """ Lists a directory as scan_dir does, returning its mtime, taken before
+        the listing, with its files and subdirectories, or None when it
+        cannot be read. The mtime is None when the directory changed within
+        SETTLE_NS of started (by default now), so that it is listed again. A
+        cached (mtime, files, subdirs) listing with the directory's current
+        mtime is returned as it is, without listing the directory. """
+    try:
+        mtime = os.stat(os.path.join(root, reldir)).st_mtime_ns
+    except OSError:
+        return None
+    if cached is not None and cached[0] == mtime:
+        return cached
+    files, subdirs = scan_dir(root, reldir)
+    if (started or time.time_ns()) - mtime < SETTLE_NS:
+        mtime = None
+    return mtime, files, subdirs
+
+
+class Manifest:
+    """ A persistent record of the directories under a root, holding each
+        directory's mtime, its subdirectories and the classified records of
+        its files. Refreshing a FileSet from the manifest relists only the
+        directories whose mtime has changed since the last run. """
+
+    Directory = namedtuple("Directory", ['mtime', 'files', 'subdirs'])
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @classmethod
+    def for_root(cls, root, cache_dir=None):
+        """ Returns the manifest stored for root in the cache directory. """
+        key = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()
+        return cls(Path(cache_dir or default_cache_dir()) / f"{key}.sqlite")
+
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            conn.executescript(f"""
+                DROP TABLE IF EXISTS meta;
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS files;
+                PRAGMA user_version = {SCHEMA_VERSION};
+                """)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, mtime INTEGER, subdirs TEXT);
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT, relpath TEXT, item TEXT, seq INTEGER, ext TEXT);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            """)
+        return conn
+
+    @staticmethod
+    def signature(fileset):
+        """ Identifies the classification rules the cached records were built
+            with, so that records are discarded when the rules change. """
+        return fileset.classifier.signature
+
+    def load(self, fileset):
+        """ Returns the stored directories as a dict keyed by relative path. """
+        if not self.path.exists():
+            return {}
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            if row is None or row[0] != self.signature(fileset):
+                return {}
+            dirs = {path: self.Directory(mtime, [], json.loads(subdirs))
+                    for path, mtime, subdirs in conn.execute(
+                        "SELECT path, mtime, subdirs FROM dirs")}
+            for dir, *record in conn.execute("SELECT * FROM files"):
+                dirs[dir].files.append(tuple(record))
+        return dirs
+
+    def save(self, fileset, dirs, stale=()):
+        """ Writes the supplied directories, replacing any earlier records for
+            them, and drops the directories listed in stale. """
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('signature', ?)",
+                         (self.signature(fileset),))
+            for path in list(stale) + list(dirs):
+                conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+                conn.execute("DELETE FROM files WHERE dir = ?", (path,))
+            conn.executemany(
+                "INSERT INTO dirs VALUES (?, ?, ?)",
+                [(path, d.mtime, json.dumps(d.subdirs))
+                    for path, d in dirs.items()])
+            conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                [(path, *record) for path, d in dirs.items() for record in d.files])
+
+    def refresh(self, fileset, workers=DEFAULT_WORKERS):
+        """ Returns the classified records for every file below the fileset's root,
+            reusing the stored records of unchanged directories, and updates
+            the manifest with what was found. """
+        cached = self.load(fileset)
+        found = {}
+        started = time.time_ns()
+
+        def scan(root, reldir):
+            directory = cached.get(reldir)
+            listing = list_dir(root, reldir, started, directory)
+            if listing is None:
+                return [], []
+            if listing is not directory:
+                mtime, relpaths, subdirs = listing
+                directory = self.Directory(
+                    mtime, fileset.classifier.classify_batch(relpaths), subdirs
+                    )
+            found[reldir] = directory
+            return directory.files, directory.subdirs
+
+        files = list(scan_tree(fileset.root, workers, scan))
+        changed = {path: d for path, d in found.items()
+                   if cached.get(path) is not d}
+        self.save(fileset, changed, stale=cached.keys() - found.keys())
+        return files
@@ -0,0 +1,199 @@
+""" Stage timers, counters and a progress line shared by the dctools stages.
+    Code that is instrumented takes a metrics argument defaulting to NULL,
+    whose methods do nothing, so that an uninstrumented run pays only for a
+    few method calls per stage rather than per file or row. """
+
+from contextlib import contextmanager, nullcontext
+import json
+import sys
+import time
+
+
+# Minimum number of seconds between updates of the progress line.
+PROGRESS_INTERVAL = 0.5
+
+
+class Stage:
+    """ The accumulated running time of one stage and the number of units
+        (files, rows, items) that it has handled. """
+
+    __slots__ = ('name', 'unit', 'seconds', 'count', 'created')
+
+    def __init__(self, name, unit=None):
+        self.name = name
+        self.unit = unit
+        self.seconds = 0.0
+        self.count = 0
+        self.created = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.count / self.seconds if self.seconds else None
+
+    def describe(self):
+        if self.unit:
+            return f"{self.name}: {self.count:,} {self.unit} in {self.seconds:.2f}s"
+        return f"{self.name} in {self.seconds:.2f}s"
+
+    def summary(self):
+        summary = {'seconds': round(self.seconds, 6)}
+        if self.unit:
+            summary.update(count=self.count, unit=self.unit)
+            if self.rate is not None:
+                summary['per_second'] = round(self.rate, 1)
+        return summary
+
+
+class Metrics:
+    """ Records the time spent in each named stage and the units it handled,
+        and, with progress set, keeps a progress line on stream updated at most
+        every interval seconds. Time is charged to one stage at a time: while
+        a stage runs within another, such as a counted iterator pulling items
+        from a counted iterator, the outer stage's clock is paused. """
+
+    enabled = True
+
+    def __init__(self, progress=False, stream=None, interval=PROGRESS_INTERVAL):
+        self.progress = progress
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.next_update = time.monotonic() + interval
+        self.line = False
+        self.active = None
+        self.since = None
+
+    def stage(self, name, unit=None):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name, unit)
+        return stage
+
+    def charge(self, stage):
+        """ Charges the time from now on to stage (or to none, for None),
+            and returns the stage that was being charged. """
+        now = time.perf_counter()
+        previous = self.active
+        if previous is not None:
+            previous.seconds += now - self.since
+        self.active, self.since = stage, now
+        return previous
+
+    @contextmanager
+    def timed(self, name, unit=None):
+        """ Adds the time spent in the with block, apart from any stages run
+            within it, to the stage, which is yielded so that the block can
+            add to its count. """
+        stage = self.stage(name, unit)
+        previous = self.charge(stage)
+        try:
+            yield stage
+        finally:
+            self.charge(previous)
+            if self.progress:
+                self.update(stage)
+
+    def add(self, name, n=1, unit=None):
+        stage = self.stage(name, unit)
+        stage.count += n
+        if self.progress:
+            self.update(stage)
+
+    def counted(self, name, items, unit=None):
+        """ Yields items, counting each of them in the stage. The stage is
+            charged with the time spent producing each item, but not with the
+            time the consumer spends on it. """
+        stage = self.stage(name, unit)
+        items = iter(items)
+        while True:
+            previous = self.charge(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.charge(previous)
+            stage.count += 1
+            if self.progress:
+                self.update(stage)
+            yield item
+
+    def update(self, stage):
+        now = time.monotonic()
+        if now < self.next_update:
+            return
+        self.next_update = now + self.interval
+        line = f"{stage.name}: {stage.count:,} {stage.unit or ''}".rstrip()
+        elapsed = time.perf_counter() - stage.created
+        if stage.unit and elapsed:
+            line += f" ({stage.count / elapsed:,.0f}/s)"
+        self.write(line)
+
+    def write(self, line):
+        if self.stream.isatty():
+            self.stream.write(f"\r\033[K{line}")
+            self.line = True
+        else:
+            self.stream.write(f"{line}\n")
+        self.stream.flush()
+
+    def finish(self):
+        """ Replaces the progress line with the time taken by each stage. """
+        if self.progress:
+            self.write("; ".join(s.describe() for s in self.stages.values()))
+        if self.line:
+            self.stream.write("\n")
+            self.stream.flush()
+            self.line = False
+
+    def summary(self):
+        return {
+            'elapsed': round(time.perf_counter() - self.started, 6),
+            'stages': {name: stage.summary()
+                       for name, stage in self.stages.items()},
+            }
+
+    def write_json(self, path):
+        with open(path, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2)
+            handle.write("\n")
+
+
+class NullMetrics(Metrics):
+    """ Metrics that record nothing. """
+
+    enabled = False
+
+    def __init__(self):
+        self.stages = {}
+
+    def timed(self, name, unit=None):
+        return nullcontext(Stage(name, unit))
+
+    def add(self, name, n=1, unit=None):
+        pass
+
+    def counted(self, name, items, unit=None):
+        return items
+
+    def finish(self):
+        pass
+
+
+NULL = NullMetrics()
+
+
+def make_metrics(progress=False, metrics_json=None, profile=False):
+    """ Returns started ProfiledMetrics for a run that is profiled, Metrics
+        for one that shows progress or saves metrics, and NULL otherwise. """
+    if profile:
+        # Imported here so that runs without --profile do not load cProfile.
+        try:
+            from .profiling import ProfiledMetrics
+        except ImportError:
+            from profiling import ProfiledMetrics
+        metrics = ProfiledMetrics(progress)
+        metrics.start()
+        return metrics
+    return Metrics(progress) if progress or metrics_json else NULL
@@ -0,0 +1,87 @@
+""" Checks the OCR sidecars (.hocr and .xml files) of pages without parsing
+    them. Each file is memory-mapped, and only its first and last few KiB are
+    examined, apart from a search for its page identifier. """
+
+from itertools import islice
+import mmap
+import os
+import re
+
+
+OCR_EXTS = ('.hocr', '.xml')
+
+# The outcomes of a check, in the order in which they are tested.
+UNREADABLE = 'unreadable'
+EMPTY = 'empty'
+MALFORMED = 'malformed'
+TRUNCATED = 'truncated'
+NO_PAGE_ID = 'no_page_id'
+WRONG_PAGE = 'wrong_page'
+OK = 'ok'
+
+HEAD_SIZE = 4096
+TAIL_SIZE = 1024
+
+BATCH_SIZE = 512
+
+# The first element's name, skipping the XML declaration, comments, DOCTYPE and
+# processing instructions.
+ROOT_ELEMENT = re.compile(rb"<(?![?!])([A-Za-z_][\w:.\-]*)")
+
+
+def check_contents(data, page_id):
+    """ Checks the contents of a sidecar, given as bytes or an mmap, against
+        the identifier of its page. The document must end with the closing tag
+        of its first element, and must mention the page identifier. A document
+        that instead mentions another page of the same item is from the wrong
+        page. """
+    root = ROOT_ELEMENT.search(data[:HEAD_SIZE])
+    if root is None:
+        return MALFORMED
+    closing = re.compile(rb"</" + re.escape(root.group(1)) + rb"\s*>\s*\Z")
+    if closing.search(data[-TAIL_SIZE:]) is None:
+        return TRUNCATED
+    if data.find(page_id.encode()) != -1:
+        return OK
+    item = page_id.rpartition('-')[0]
+    if item and data.find(f"{item}-".encode()) != -1:
+        return WRONG_PAGE
+    return NO_PAGE_ID
+
+
+def check_sidecar(path, page_id):
+    """ Memory-maps the sidecar at path and returns the outcome of checking it
+        against page_id. """
+    try:
+        with open(path, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return EMPTY
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return check_contents(data, page_id)
+    except (OSError, ValueError):
+        return UNREADABLE
+
+
+def check_batch(tasks):
+    return [check_sidecar(path, page_id) for path, page_id in tasks]
+
+
+def check_sidecars(fileset, workers=None):
+    """ Sets fileset.ocr to a dict giving the outcome of checking each OCR
+        sidecar of a page, keyed by relative path. Batches of files are checked
+        in a pool of worker processes. Returns the number of files checked. """
+    # Imported here so that importing OCR_EXTS stays cheap for validate.
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    root = fileset.root
+    sidecars = [f for f in fileset if f.seq is not None and f.ext in OCR_EXTS]
+    tasks = iter([(os.path.join(root, f.path), f.base) for f in sidecars])
+    batches = iter(lambda: list(islice(tasks, BATCH_SIZE)), [])
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        outcomes = [o for batch in pool.map(check_batch, batches) for o in batch]
+    fileset.ocr = {f.path: o for f, o in zip(sidecars, outcomes)}
+    return len(sidecars)
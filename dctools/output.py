@@ -0,0 +1,107 @@
+""" Buffered report output to stdout or a file, optionally gzipped, as CSV or
+    JSON Lines. """
+
+import csv
+import gzip
+import io
+from itertools import islice
+import json
+import sys
+
+
+BUFFER_SIZE = 2**20
+
+BATCH_SIZE = 1024
+
+FORMATS = ('csv', 'jsonl')
+
+
+def guess_format(path):
+    """ Returns 'jsonl' for paths named .json or .jsonl (optionally followed by
+        .gz), and 'csv' otherwise. """
+    if path and path.removesuffix('.gz').endswith(('.json', '.jsonl')):
+        return 'jsonl'
+    return 'csv'
+
+
+class FlushingWriter(io.BufferedWriter):
+    """ A BufferedWriter whose flush also flushes the stream it writes to, so
+        that a flushed report reaches its file (through any gzip stream) at
+        once. """
+
+    def flush(self):
+        super().flush()
+        self.raw.flush()
+
+
+class Output:
+    """ A text stream to path, or to stdout when path is None or '-', that is
+        written to its destination in blocks of BUFFER_SIZE bytes, and
+        whenever it is flushed. The stream is gzipped when compress is set or
+        path ends in .gz. Closing it leaves stdout open. A stdout without a
+        binary buffer, such as a StringIO put in its place, is written to
+        directly, and cannot be gzipped. """
+
+    def __init__(self, path=None, compress=False):
+        self.path = None if path == '-' else path
+        self.compress = compress or bool(self.path and self.path.endswith('.gz'))
+        self.gzip = self.buffer = None
+        if self.path is None and not hasattr(sys.stdout, 'buffer'):
+            if self.compress:
+                raise ValueError("Cannot gzip to a stdout without a buffer")
+            self.raw = None
+            self.stream = sys.stdout
+            return
+        if self.path is None:
+            sys.stdout.flush()
+            raw = sys.stdout.buffer
+        else:
+            raw = open(self.path, 'wb', buffering=0)
+        self.raw = raw
+        if self.compress:
+            raw = gzip.GzipFile(filename=self.path or '', fileobj=raw,
+                                mode='wb', compresslevel=6)
+        self.gzip = raw if self.compress else None
+        self.buffer = FlushingWriter(raw, BUFFER_SIZE)
+        self.stream = io.TextIOWrapper(self.buffer, encoding='utf-8',
+                                       newline='')
+
+    def __enter__(self):
+        return self.stream
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stream.flush()
+        if self.raw is None:
+            return
+        self.stream.detach()
+        self.buffer.detach()
+        if self.gzip is not None:
+            self.gzip.close()
+        if self.path is None:
+            self.raw.flush()
+        else:
+            self.raw.close()
+
+
+def write_rows(handle, fieldnames, rows, format='csv'):
+    """ Writes a header (for CSV) and then dict rows, in batches. As with
+        csv.DictWriter(extrasaction='ignore'), only the keys in fieldnames are
+        written and missing keys are left empty. JSON Lines rows are objects
+        with exactly the fieldnames as keys. """
+    rows = iter(rows)
+    if format == 'jsonl':
+        dumps = json.dumps
+        while batch := list(islice(rows, BATCH_SIZE)):
+            handle.write("".join(
+                dumps({key: row.get(key, "") for key in fieldnames}) + "\n"
+                for row in batch
+                ))
+    else:
+        writer = csv.DictWriter(handle, fieldnames=fieldnames,
+                                extrasaction='ignore')
+        writer.writeheader()
+        while batch := list(islice(rows, BATCH_SIZE)):
+            writer.writerows(batch)
@@ -1,38 +1,228 @@
 #!/usr/bin/env python3
 
+from array import array
 import csv
+import marshal
+import os
 import sys
 
-from avalon import Batch, Item, BinarySet
+import click
 
-metadata = sys.argv[1]
-filescsv = sys.argv[2]
-outputfile = sys.argv[3]
+try:
+    from .avalon import Batch
+    from .binaries import DEFAULT_WORKERS, FileSet
+    from .metrics import make_metrics
+except ImportError:
+    from avalon import Batch
+    from binaries import DEFAULT_WORKERS, FileSet
+    from metrics import make_metrics
 
 
-if __name__ == "__main__":
+INDEX_VERSION = 1
+
+
+class FileIndex:
+    """ Maps filenames to the paths of the files, keeping the first path seen
+        for each name. Directories are interned as path prefixes, so that each
+        entry holds only its name and a directory code; a path that does not
+        end in its name is interned whole, under a negative code. The index is
+        saved with marshal, its names joined into a single string, so that it
+        loads without parsing. """
+
+    def __init__(self):
+        self.dirs = []
+        self.dir_codes = {}
+        self.entries = {}
+
+    def add(self, path, name=None):
+        """ Adds the path of the file name, by default the last component of
+            the path. """
+        if name is None:
+            name = os.path.basename(path)
+        if name in self.entries:
+            return
+        whole = not name or os.path.basename(path) != name
+        prefix = path if whole else path[:len(path) - len(name)]
+        code = self.dir_codes.get(prefix)
+        if code is None:
+            code = self.dir_codes[prefix] = len(self.dirs)
+            self.dirs.append(prefix)
+        self.entries[name] = ~code if whole else code
+
+    @classmethod
+    def from_csv(cls, path, name_column='FILENAME', path_column='PATH'):
+        """ Builds an index from a files CSV with a name and a path column,
+            keeping each path as given. """
+        index = cls()
+        with open(path, newline='') as handle:
+            for row in csv.DictReader(handle):
+                index.add(row[path_column], row[name_column])
+        return index
+
+    @classmethod
+    def from_fileset(cls, fileset):
+        """ Builds an index of the files found by crawling a FileSet. """
+        index = cls()
+        for relpath in fileset.paths:
+            index.add(os.path.join(fileset.root, relpath))
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """ Reads an index saved by save(). Raises ValueError if it was saved in
+            another format. """
+        with open(path, 'rb') as handle:
+            try:
+                version, dirs, names, codes = marshal.load(handle)
+            except (EOFError, TypeError, ValueError):
+                raise ValueError(f"{path} is not a file index")
+        if version != INDEX_VERSION:
+            raise ValueError(f"{path} is an index of version {version}")
+        index = cls()
+        index.dirs = dirs
+        index.dir_codes = {d: n for n, d in enumerate(dirs)}
+        dir_codes = array('i')
+        dir_codes.frombytes(codes)
+        index.entries = dict(zip(names.split('\0') if names else (), dir_codes))
+        return index
+
+    def save(self, path):
+        # File names cannot contain NUL, so it safely separates them.
+        data = (INDEX_VERSION, self.dirs, '\0'.join(self.entries),
+                array('i', self.entries.values()).tobytes())
+        with open(path, 'wb') as handle:
+            marshal.dump(data, handle)
+
+    def get(self, name):
+        code = self.entries.get(name)
+        if code is None:
+            return None
+        return self.dirs[code] + name if code >= 0 else self.dirs[~code]
+
+    def parts(self, identifier, ext):
+        """ Returns the paths of the numbered parts of an item (identifier-0001
+            with ext, identifier-0002, ...), up to the first missing part. """
+        entries = self.entries
+        dirs = self.dirs
+        paths = []
+        while True:
+            name = f"{identifier}-{len(paths) + 1:04d}{ext}"
+            code = entries.get(name)
+            if code is None:
+                return paths
+            paths.append(dirs[code] + name if code >= 0 else dirs[~code])
+
+    def match(self, identifiers, ext):
+        """ Returns a dict of the part paths of each identifier that has any. """
+        matches = {}
+        for identifier in identifiers:
+            paths = self.parts(identifier, ext)
+            if paths:
+                matches[identifier] = paths
+        return matches
+
+    def __len__(self):
+        return len(self.entries)
 
-    batch = Batch().from_csv(metadata)
-
-    lookup = {}
-    with open(filescsv) as handle:
-        reader = csv.DictReader(handle)
-        for row in reader:
-            lookup.setdefault(row['FILENAME'], row['PATH'])
-
-    with open(outputfile, 'w') as handle:
-        writer = csv.writer(handle)
-        writer.writerow(batch.headers)
-        filecol = headers.index('File')
-        for row in data:
-            filename = row[3] + '-0001.mp4'
-            row[filecol] = lookup[filename]
-            writer.writerow(row)
-
-    print(testcsv.title)
-    print(testcsv.contact)
-    print(len(testcsv.contents))
-    for n, item in enumerate(testcsv.contents, 1):
-        print(f"\nITEM #{n}:")
-        print("=============")
-        print(item)
+    def __contains__(self, name):
+        return name in self.entries
+
+
+def set_files(item, paths, column='File'):
+    """ Replaces an Avalon Item's values for column with paths. """
+    item.fields = [(k, v) for k, v in item.fields if k != column] + [
+        (column, path) for path in paths
+        ]
+    item.metadata[column] = list(paths)
+
+
+def widen(headers, column, n):
+    """ Returns headers with column repeated at least n times. """
+    return headers + [column] * (n - headers.count(column))
+
+
+@click.command()
+@click.argument('metadata', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--files', 'files_csv', type=click.Path(exists=True),
+              help='Build the index from a CSV of FILENAME and PATH columns.')
+@click.option('--root', type=click.Path(exists=True, file_okay=False),
+              help='Build the index by crawling this directory.')
+@click.option('--index', 'index_path', type=click.Path(dir_okay=False),
+              help='Load the index from this file, or save it here once built.')
+@click.option('--rebuild', is_flag=True,
+              help='Build the index even if the --index file exists.')
+@click.option('--workers', default=DEFAULT_WORKERS, show_default=True,
+              help='Number of threads used to crawl --root.')
+@click.option('--id-column', default='Other Identifier', show_default=True,
+              help='Column holding the identifier that file names start with.')
+@click.option('--ext', default='.mp4', show_default=True,
+              help='Extension of the media files.')
+@click.option('--profile', is_flag=True,
+              help='Profile each stage, saving pstats and collapsed stacks to '
+                   'a .profile directory beside the output, and list the '
+                   'hottest functions on stderr.')
+def populate(metadata, output, files_csv, root, index_path, rebuild, workers,
+             id_column, ext, profile):
+    """ Fills the File columns of an Avalon batch CSV with the paths of each
+        item's media files, adding File columns for items in several parts. """
+    metrics = make_metrics(profile=profile)
+    index = None
+    with metrics.timed('index', 'files') as stage:
+        if index_path and os.path.exists(index_path) and not rebuild:
+            try:
+                index = FileIndex.load(index_path)
+            except ValueError as e:
+                if not (files_csv or root):
+                    raise click.BadParameter(str(e), param_hint='--index')
+        if index is None:
+            if files_csv:
+                index = FileIndex.from_csv(files_csv)
+            elif root:
+                index = FileIndex.from_fileset(
+                    FileSet(root, workers, metrics=metrics)
+                    )
+            else:
+                raise click.UsageError(
+                    "Supply --files, --root or an existing --index")
+            if index_path:
+                index.save(index_path)
+        stage.count += len(index)
+    sys.stderr.write(f"Indexed {len(index)} files\n")
+
+    batch = Batch.from_csv(metadata, stream=True)
+    if id_column not in batch.headers:
+        raise click.BadParameter(f"{metadata} has no {id_column!r} column",
+                                 param_hint='--id-column')
+    with metrics.timed('match', 'items') as stage:
+        matches = index.match(
+            (item.metadata.get(id_column, [''])[0] for item in batch.contents),
+            ext
+            )
+        stage.count += len(matches)
+    sys.stderr.write(f"Matched files for {len(matches)} items\n")
+
+    batch = Batch.from_csv(metadata, stream=True)
+    batch.headers = widen(batch.headers, 'File',
+                          max(map(len, matches.values()), default=1))
+
+    def completed(items):
+        for item in items:
+            paths = matches.get(item.metadata.get(id_column, [''])[0])
+            if paths:
+                set_files(item, paths)
+            yield item
+
+    batch.contents = completed(batch.contents)
+    with metrics.timed('write'):
+        batch.serialize(output)
+    if profile:
+        try:
+            from .profiling import profile_directory
+        except ImportError:
+            from profiling import profile_directory
+        metrics.close(profile_directory(output))
+
+
+if __name__ == "__main__":
+    populate()
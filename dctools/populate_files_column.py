@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 
-from collections import namedtuple
-from collections.abc import Collection
-import csv
-from pathlib import Path
-import re
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing
 import sys
 
+try:
+    from .archelon import MetadataCsv, Registry
+    from .binaries import FileSet
+    from .fixity import ALGORITHMS, DigestCache, compute_digests
+    from .metrics import make_metrics
+    from .output import FORMATS, guess_format
+except ImportError:
+    from archelon import MetadataCsv, Registry
+    from binaries import FileSet
+    from fixity import ALGORITHMS, DigestCache, compute_digests
+    from metrics import make_metrics
+    from output import FORMATS, guess_format
+
+
+DEFAULT_CHUNKSIZE = 256
 
-class Item:
 
-    _registry = {}
+class Item:
 
     image_formats = [
             "http://vocab.lib.umd.edu/form#photographs",
@@ -71,15 +85,12 @@ class Item:
         self.set_label()
 
     @classmethod
-    def from_registry(cls, metadata):
+    def from_registry(cls, metadata, registry):
         """
         Returns the object with the supplied identifier or creates and registers a 
         new object if none exists with the supplied identifier.
         """
-        identifier = metadata['Identifier']
-        if identifier not in cls._registry:
-            cls._registry[identifier] = cls(metadata)
-        return cls._registry[identifier]
+        return registry.get(cls, metadata['Identifier'], metadata)
 
     def __lt__(self, other):
         return self.identifier < other.identifier
@@ -87,10 +98,14 @@ class Item:
     def __repr__(self):
         return f"Item Object ({self.identifier})"
 
-    def get_members_and_files(self, fileset):
-        files = fileset.get_members(self.identifier, self.metadata['next_id'])
+    def get_members_and_files(self, fileset, registry, partition=None):
+        if partition is not None:
+            files = partition.get_members(self.identifier)
+        else:
+            files = fileset.get_members(self.identifier,
+                                        self.metadata['next_id'])
         for f in files:
-            page = Page.from_registry(f.base)
+            page = Page.from_registry(f.base, registry)
             page.files.append(f)
             if page not in self.pages:
                 self.pages.append(page)
@@ -109,21 +124,17 @@ class Item:
 
 class Page:
 
-    _registry = {}
-
     def __init__(self, identifier):
         self.identifier = identifier
         self.files = []
 
     @classmethod
-    def from_registry(cls, identifier):
+    def from_registry(cls, identifier, registry):
         """
         Returns the object with the supplied identifier or creates and registers a 
         new object if none exists with the supplied identifier.
         """
-        if identifier not in cls._registry:
-            cls._registry[identifier] = cls(identifier)
-        return cls._registry[identifier]
+        return registry.get(cls, identifier)
 
     def __lt__(self, other):
         return self.identifier < other.identifier
@@ -132,153 +143,183 @@ class Page:
         return f"Page Object ({self.identifier})"
 
 
-class ArchelonBatchCsv:
-
-    def __init__(self, path):
-        self.path = path
-        with open(self.path, 'r') as handle:
-            reader = csv.DictReader(handle)
-            self.fieldnames = reader.fieldnames
-            self.rows = [row for row in reader]
-            for n in range(len(self.rows)):
-                row = self.rows[n]
-                try:
-                    row['next_id'] = self.rows[n+1]['Identifier']
-                except IndexError:
-                    row['next_id'] = None
-
-    def add_files_column(self, files):
-        if 'FILES' not in self.fieldnames:
-            self.fieldnames.append('FILES')
-        for row in self.rows:
-            sys.stderr.write(f"Working on {row['Identifier']}\n")
-            item = Item.from_registry(row)
-            item.get_members_and_files(files)
-            if not 'FILES' in row:
-                entries = []
-                for n, page in enumerate(sorted(item.pages), 1):
-                    entries.append(f"{item.label} {n}:" + ";".join(
-                        [f"{f.usage}{f.relpath}" for f in page.files]
-                        ))
-                row['FILES'] = ";".join(entries)
-
-    def add_item_files_column(self, files):
-        if 'ITEM_FILES' not in self.fieldnames:
-            self.fieldnames.append('ITEM_FILES')
-        for row in self.rows:
-            if not 'ITEM_FILES' in row or row['ITEM_FILES'] == '':
-                row['ITEM_FILES'] = ';'.join(
-                    files.get_item_level(row['Identifier'])
-                    )
-
-    def write(self):
-        writer = csv.DictWriter(sys.stdout,
-                                fieldnames=self.fieldnames, 
-                                extrasaction='ignore')
-        writer.writeheader()
-        for row in self.rows:
-            writer.writerow(row)
-
-
-class FileSet(Collection):
-
-    File = namedtuple("File", ['relpath', 'base', 'item', 'ext', 'seq', 'usage'])
-
-    item_pattern = r"^[a-z]+?-\d{6}$"
-    member_pattern = r"^([a-z]+?-\d{6})-(\d{4})$"
-
-    use_ext = {".tif": "<preservation>",
-               ".jpg": "<preservation>",
-               ".hocr": "<ocr>",
-               ".xml": "<ocr>"}
-
-    def __init__(self, root):
-        self.contents = set()
-        files = [p for p in Path(root).rglob("*") if p.is_file()]
+class ArchelonBatchCsv(MetadataCsv):
+    """
+    The rows of an Archelon batch CSV. With stream=True the rows are read one
+    at a time as they are written, so that memory use does not grow with the
+    size of the CSV, and the Items and Pages built for them are held in a
+    registry that is bounded. The rows read, joined to their files and
+    written are counted in metrics.
+    """
 
-        for f in files:
-            item_match = re.match(self.item_pattern, f.stem)
-            member_match = re.match(self.member_pattern, f.stem)
-            if item_match:
-                item = f.stem
-                seq = None
-            elif member_match:
-                item = member_match.group(1)
-                seq = int(member_match.group(2))
-            else:
-                item = None
-                seq = None
-            try:
-                usage = self.use_ext[f.suffix]
-            except KeyError:
-                usage = None
-            self.contents.add(self.File(relpath = f.relative_to(root),
-                                        base = f.stem,
-                                        item = item,
-                                        ext = f.suffix,
-                                        seq = seq,
-                                        usage = usage
-                                        ))
-
-    def __iter__(self):
-        return iter(self.contents)
-
-    def __len__(self):
-        return len(self.contents)
-
-    def __contains__(self, other):
-        if other in self.contents:
-            return True
-        else:
-            return False
-
-    def get_best_images(self, item_files):
-        ''' Given a set of item-level files, return all tiffs or all jpegs plus 
-            all ancillary files. '''
-        all_pages = set([f.base for f in item_files])
-        tiffs = set([f for f in item_files if f.ext == '.tif'])
-        jpegs = set([f for f in item_files if f.ext == '.jpg'])
-        non_image = set([f for f in item_files if f.ext not in ['.tif', '.jpg']])
-        if set([f.base for f in tiffs]) == all_pages:
-            return tiffs.union(non_image)
-        elif set([f.base for f in jpegs]) == all_pages:
-            return jpegs.union(non_image)
-        else:
-            return non_image
-
-    def get_members(self, id, next_id):
-        parts = id.split('-')
-        if len(parts) == 2:
-            files = sorted(
-                [f for f in self.contents if f.item == id and f.seq is not None]
-                )
-        elif len(parts) == 3:
-            id = "-".join(parts[:2])
-            start = int(parts[2])
-            if "-".join(next_id.split('-')[:2]) != id:
-                files = sorted(
-                    [f for f in self.contents if f.item == id and f.seq >= start]
-                    )
-            else:
-                limit = int(next_id.split('-')[2])
-                page_range = [i for i in range(start, limit)]
-                files = sorted(
-                    [f for f in self.contents if f.item == id and f.seq in page_range]
-                    )
-        return files
-
-    def get_item_level(self, item):
-        return [
-            str(f.relpath) for f in self.contents if f.item == item and f.seq is None
-            ]
+    def add_columns(self, files, workers=1, chunksize=DEFAULT_CHUNKSIZE,
+                    partition=None):
+        """
+        Adds both the FILES and ITEM_FILES columns, dividing the member files
+        among the rows by partition, or as add_files_column does without one.
+        With more than one worker the rows are sent in chunks to a pool of
+        processes, which share the FileSet and any Partition, and are
+        returned in their original order.
+        """
+        if partition is None and not self.stream:
+            partition = self.partition(files)
+        if workers <= 1:
+            self.add_files_column(files, partition)
+            self.add_item_files_column(files)
+            return
+        for column in ('FILES', 'ITEM_FILES'):
+            if column not in self.fieldnames:
+                self.fieldnames.append(column)
+        rows = self.metrics.counted('join', complete_in_pool(
+            self.rows, files, partition, self.registry.maxsize, workers,
+            chunksize
+            ), 'rows')
+        self.rows = rows if self.stream else list(rows)
+
+
+def set_files(row, files, registry, partition=None):
+    item = Item.from_registry(row, registry)
+    item.get_members_and_files(files, registry, partition)
+    if not 'FILES' in row:
+        entries = []
+        for n, page in enumerate(sorted(item.pages), 1):
+            entries.append(f"{item.label} {n}:" + ";".join(
+                [file_entry(f, files) for f in page.files]
+                ))
+        row['FILES'] = ";".join(entries)
+
+
+def file_entry(f, files):
+    """
+    Returns the FILES entry for a file: its usage and path, followed by any
+    digests computed for it as a #alg=digest&alg=digest fragment.
+    """
+    entry = f"{f.usage}{f.path}"
+    digests = files.digests.get(f.path)
+    if digests:
+        entry += "#" + "&".join(
+            f"{alg}={value}" for alg, value in sorted(digests.items())
+            )
+    return entry
+
+
+def set_item_files(row, files):
+    if not 'ITEM_FILES' in row or row['ITEM_FILES'] == '':
+        row['ITEM_FILES'] = ';'.join(
+            files.get_item_level(row['Identifier'])
+            )
+
+
+_worker_state = None
+
+
+def init_worker(files, partition, maxsize):
+    global _worker_state
+    _worker_state = (files, partition, Registry(maxsize))
+
+
+def complete_rows(rows):
+    files, partition, registry = _worker_state
+    for row in rows:
+        set_files(row, files, registry, partition)
+        set_item_files(row, files)
+    return rows
+
+
+def complete_in_pool(rows, files, partition, maxsize, workers, chunksize):
+    """
+    Yields the rows with their FILES and ITEM_FILES columns completed by a
+    pool of worker processes, keeping at most two chunks per worker in flight.
+    Workers are forked where possible so that the FileSet and Partition are
+    shared rather than copied to each of them. Each worker keeps its own
+    registry, bounded by maxsize.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    rows = iter(rows)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=init_worker,
+                             initargs=(files, partition, maxsize)) as pool:
+        pending = deque()
+        while chunk := list(islice(rows, chunksize)):
+            pending.append(pool.submit(complete_rows, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
 
 
 if __name__ == "__main__":
 
-    inputcsv = ArchelonBatchCsv(sys.argv[1])
-    sys.stderr.write(f"Read {len(inputcsv.rows)} lines of metadata\n")
-    fileset = FileSet(sys.argv[2])
+    parser = argparse.ArgumentParser(
+        description="Add FILES and ITEM_FILES columns to an Archelon batch CSV."
+        )
+    parser.add_argument('metadata', help="Archelon batch CSV")
+    parser.add_argument('root', help="directory containing the binaries")
+    parser.add_argument('--stream', action='store_true',
+                        help="process and write one row at a time")
+    parser.add_argument('--partition', action='store_true',
+                        help="with --stream, first divide the files among "
+                             "the rows in a pass over the CSV, reporting "
+                             "orphan pages and overlapping rows")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes building the columns")
+    parser.add_argument('--output', '-o',
+                        help="write to this file instead of stdout")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="output format (default: from the output name, "
+                             "otherwise csv)")
+    parser.add_argument('--gzip', action='store_true',
+                        help="gzip the output (implied by a .gz output name)")
+    parser.add_argument('--fixity', action='append', choices=ALGORITHMS,
+                        help="add digests made with this algorithm to FILES")
+    parser.add_argument('--fixity-rate', type=int,
+                        help="limit hashing to this many bytes per second")
+    parser.add_argument('--no-fixity-cache', action='store_true',
+                        help="read every file rather than reuse saved digests")
+    parser.add_argument('--progress', action='store_true',
+                        help="show a progress line on stderr")
+    parser.add_argument('--metrics-json',
+                        help="save the time and throughput of each stage here")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile each stage, saving pstats and collapsed "
+                             "stacks beside the output, and list the hottest "
+                             "functions on stderr")
+    args = parser.parse_args()
+
+    metrics = make_metrics(args.progress, args.metrics_json, args.profile)
+    inputcsv = ArchelonBatchCsv(args.metadata, stream=args.stream,
+                                metrics=metrics)
+    if not args.stream:
+        sys.stderr.write(f"Read {len(inputcsv.rows)} lines of metadata\n")
+    fileset = FileSet(args.root, metrics=metrics)
     sys.stderr.write(f"Found {len(fileset)} files\n")
-    inputcsv.add_files_column(fileset)
-    inputcsv.add_item_files_column(fileset)
-    inputcsv.write()
+    if args.fixity:
+        cache = None if args.no_fixity_cache else DigestCache()
+        with metrics.timed('fixity', 'files') as stage:
+            stage.count = compute_digests(fileset, args.fixity, cache=cache,
+                                          rate=args.fixity_rate)
+        sys.stderr.write(f"Hashed {stage.count} files\n")
+    if args.stream and not args.partition:
+        partition = None
+    else:
+        partition = inputcsv.partition(fileset)
+        for page in partition.orphan_pages():
+            sys.stderr.write(f"Orphan page not in any row: {page}\n")
+        for first, second in partition.overlaps:
+            sys.stderr.write(f"Overlapping rows: {first} and {second}\n")
+    inputcsv.add_columns(fileset, args.workers, partition=partition)
+    inputcsv.write(args.output, args.format or guess_format(args.output),
+                   args.gzip)
+    metrics.finish()
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.profile:
+        try:
+            from .profiling import profile_directory
+        except ImportError:
+            from profiling import profile_directory
+        metrics.close(profile_directory(args.output))
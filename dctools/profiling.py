@@ -0,0 +1,180 @@
+""" Profiles the stages of a dctools run. Each stage timed or counted through
+    metrics gets a cProfile profile of its own, and the main thread's stack is
+    sampled for collapsed-stack output that flamegraph.pl or speedscope can
+    draw. Work done in pools of threads or processes is seen only as the
+    main thread waiting for it.
+
+    with profiled('profile') as metrics:
+        fileset = FileSet(root, metrics=metrics)
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+try:
+    from .metrics import PROGRESS_INTERVAL, Metrics
+except ImportError:
+    from metrics import PROGRESS_INTERVAL, Metrics
+
+
+DEFAULT_TOP = 15
+
+# Seconds between samples of the main thread's stack.
+SAMPLE_INTERVAL = 0.005
+
+# The stage to which time outside every stage is attributed.
+OTHER = 'other'
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return (f"{code.co_qualname} "
+            f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+
+
+def function_name(function):
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class ProfiledMetrics(Metrics):
+    """ Metrics that also profile each stage, attributing time to the stage
+        being charged and to OTHER outside every stage. Profiling runs
+        between start and stop. """
+
+    def __init__(self, progress=False, stream=None, interval=PROGRESS_INTERVAL,
+                 sample_interval=SAMPLE_INTERVAL):
+        super().__init__(progress, stream, interval)
+        self.sample_interval = sample_interval
+        self.profiles = {}
+        self.samples = {}
+        self.current = None
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def switch(self, name):
+        """ Moves profiling to the stage name (or stops it, for None) and
+            returns the stage that was being profiled. """
+        previous = self.current
+        if name == previous:
+            return previous
+        if previous is not None:
+            self.profiles[previous].disable()
+        self.current = name
+        if name is not None:
+            if name not in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+            self.profiles[name].enable()
+        return previous
+
+    def start(self):
+        self.switch(self.active.name if self.active is not None else OTHER)
+        main = threading.get_ident()
+        self.stopping.clear()
+        self.sampler = threading.Thread(target=self.sample, args=(main,),
+                                        daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.switch(None)
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+
+    def sample(self, thread):
+        while not self.stopping.wait(self.sample_interval):
+            stage, frame = self.current, sys._current_frames().get(thread)
+            if stage is None or frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            self.samples.setdefault(stage, Counter())[
+                ";".join(reversed(stack))
+                ] += 1
+
+    def charge(self, stage):
+        previous = super().charge(stage)
+        if self.current is not None:
+            self.switch(stage.name if stage is not None else OTHER)
+        return previous
+
+    def stats(self):
+        """ Returns pstats.Stats for each stage that was profiled. """
+        return {name: pstats.Stats(profile)
+                for name, profile in self.profiles.items()
+                if profile.getstats()}
+
+    def save(self, directory):
+        """ Saves each stage's profile as STAGE.pstats and its sampled stacks
+            as STAGE.collapsed in directory. """
+        os.makedirs(directory, exist_ok=True)
+        for name, stats in self.stats().items():
+            stats.dump_stats(os.path.join(directory, f"{name}.pstats"))
+        for name, stacks in self.samples.items():
+            with open(os.path.join(directory, f"{name}.collapsed"), 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+
+    def hot_functions(self, top=DEFAULT_TOP):
+        """ Returns the top functions by time spent in them, excluding their
+            callees, as (seconds, calls, function, stage) tuples. """
+        functions = [
+            (tottime, calls, function_name(function), name)
+            for name, stats in self.stats().items()
+            for function, (_, calls, tottime, _, _) in stats.stats.items()
+            ]
+        return sorted(functions, reverse=True)[:top]
+
+    def write_top(self, top=DEFAULT_TOP, stream=None):
+        stream = stream or sys.stderr
+        stream.write(f"{'seconds':>9} {'calls':>10}  function [stage]\n")
+        for seconds, calls, function, stage in self.hot_functions(top):
+            stream.write(
+                f"{seconds:>9.3f} {calls:>10,}  {function} [{stage}]\n"
+                )
+        stream.flush()
+
+    def close(self, directory=None, top=DEFAULT_TOP, stream=None):
+        """ Stops profiling, saves the profile to directory when one is given
+            and writes the top hot functions to stream (stderr by default). """
+        self.stop()
+        stream = stream or sys.stderr
+        if top:
+            self.write_top(top, stream)
+        if directory:
+            self.save(directory)
+            stream.write(f"Saved profile to {directory}\n")
+            stream.flush()
+
+
+def profile_directory(report=None):
+    """ Returns the directory in which to save the profile of a run, beside its
+        report or in the current directory when it writes to stdout. """
+    if report and report != '-':
+        return f"{report}.profile"
+    return f"dctools-{time.strftime('%Y%m%d-%H%M%S')}.profile"
+
+
+@contextmanager
+def profiled(directory=None, top=DEFAULT_TOP, progress=False, stream=None):
+    """ Profiles the with block, yielding ProfiledMetrics to pass to the
+        functions whose stages are to be told apart. On exit the profile is
+        saved to directory, when one is given, and the top hot functions are
+        written to stream (stderr by default). """
+    metrics = ProfiledMetrics(progress)
+    metrics.start()
+    try:
+        yield metrics
+    finally:
+        metrics.close(directory, top, stream)
@@ -1,37 +1,645 @@
-from .binaries import FileSet
-from .archelon import Item, Page
+from .binaries import DEFAULT_WORKERS, FileSet, get_classifier
+from .binaries import scan_dir, shard_scan
+from .metrics import make_metrics
+from .output import FORMATS, Output, guess_format
+from .archelon import Registry
+from .ocr import OCR_EXTS
 import click
 import csv
-import sys
+import gzip
+import heapq
+from itertools import groupby, islice
+import json
+from operator import itemgetter
+import os
+import tempfile
+
+
+HEADER = ["id","item_files","tif","hocr","xml"]
+
+COUNTED = ['.tif', '.hocr', '.xml']
+
+IMAGE_COLUMNS = ["image_check", "image_info"]
+
+DIFF_HEADER = ["id", "change", "path"] + HEADER[1:]
+
+PARTIAL_VERSION = 1
+
+# The choices and default of the fixity options, kept in step with fixity,
+# which is imported only when --fixity is given.
+FIXITY_ALGORITHMS = ('md5', 'sha256')
+
+FIXITY_WORKERS = 4
+
+
+def report_header(algorithms=(), ocr=False, images=False):
+    """ Returns the report columns, with a column of digests for the item files
+        and each counted extension per fixity algorithm, with ocr set a column
+        of the outcomes of checking each kind of OCR sidecar, and with images
+        set columns of the outcome and findings of probing page images. """
+    return HEADER + [f"{column}_{alg}" for alg in algorithms
+                     for column in HEADER[1:]] + [
+        f"{ext.strip('.')}_check" for ext in OCR_EXTS if ocr
+        ] + (IMAGE_COLUMNS if images else [])
+
+
+def file_digests(files, digests, alg):
+    """ Returns the alg digest of each file, or "" for files without one, keyed
+        by path. """
+    return {f.path: digests.get(f.path, {}).get(alg, "") for f in files}
+
+
+def joined_by_path(values):
+    """ Joins values keyed by path into a report cell, in path order. """
+    return ";".join(value for _, value in sorted(
+        values.items(), key=lambda entry: entry[0].split(os.sep)
+        ))
+
+
+def item_summary(item, digests=None, algorithms=(), ocr=None, probes=None,
+                 stats=False):
+    """ Returns what the report shows of an Item as a JSON-ready dict: its
+        number of item-level files and the file counts of each of its pages by
+        extension, with the digests of the reported files and, when ocr holds
+        the outcomes of checking sidecars, those of each page's sidecars, and
+        likewise for probes of images. With stats set, the [size, mtime] of
+        each of its files is added under 'files', keyed by path. This is also
+        the form in which items are saved in partial results. """
+    summary = {
+        'id': item.identifier,
+        'item_files': len(item.files),
+        'digests': {alg: file_digests(item.files, digests, alg)
+                    for alg in algorithms},
+        'pages': [
+            {
+                'id': page.identifier,
+                'counts': dict(page.counts),
+                'digests': {alg: {ext: file_digests(
+                    [f for f in page.files if f.ext == ext], digests, alg
+                    ) for ext in COUNTED} for alg in algorithms},
+            }
+            for page in sorted(item.pages)
+            ],
+        }
+    if ocr is not None:
+        for page, entry in zip(sorted(item.pages), summary['pages']):
+            entry['ocr'] = {ext: {f.path: ocr.get(f.path, "")
+                                  for f in page.files if f.ext == ext}
+                            for ext in OCR_EXTS}
+    if probes is not None:
+        for page, entry in zip(sorted(item.pages), summary['pages']):
+            entry['images'] = {
+                f.path: [probes[f.path].status, probes[f.path].describe()]
+                for f in page.files if f.path in probes
+                }
+    if stats:
+        summary['files'] = {
+            f.path: [f.size, f.mtime]
+            for f in item.files.union(*(page.files for page in item.pages))
+            }
+    return summary
+
+
+def item_rows(item, digests=None, algorithms=(), ocr=None, probes=None):
+    """ Returns the report rows for an Item or an item summary, or for the
+        identifier of an item that no longer has any files. """
+    if isinstance(item, str) or item is None:
+        return [[item, 0]]
+    if not isinstance(item, dict):
+        item = item_summary(item, digests, algorithms, ocr, probes)
+    row = [item['id'], item['item_files']]
+    if algorithms:
+        row += [None] * len(COUNTED)
+    for alg in algorithms:
+        row += [joined_by_path(item['digests'][alg])] + [None] * len(COUNTED)
+    rows = [row]
+    for page in item['pages']:
+        counts = page['counts']
+        row = [
+            page['id'],
+            None, # "Item files" column
+            counts.get('.tif', 0),
+            counts.get('.hocr', 0),
+            counts.get('.xml', 0)
+            ]
+        for alg in algorithms:
+            row += [None] + [
+                joined_by_path(page['digests'][alg][ext]) for ext in COUNTED
+                ]
+        if 'ocr' in page:
+            row += [joined_by_path(page['ocr'][ext]) for ext in OCR_EXTS]
+        if 'images' in page:
+            row += [joined_by_path({path: probe[n] for path, probe
+                                    in page['images'].items()})
+                    for n in range(len(IMAGE_COLUMNS))]
+        rows.append(row)
+    return rows
+
+
+def merge_summaries(summaries):
+    """ Combines summaries of the same item made from different shards or
+        roots, adding up the counts of pages found in more than one. """
+    merged = {'id': summaries[0]['id'], 'item_files': 0, 'digests': {},
+              'pages': {}}
+    for summary in summaries:
+        merged['item_files'] += summary['item_files']
+        for alg, entries in summary['digests'].items():
+            merged['digests'].setdefault(alg, {}).update(entries)
+        if 'files' in summary:
+            merged.setdefault('files', {}).update(summary['files'])
+        for page in summary['pages']:
+            target = merged['pages'].setdefault(
+                page['id'], {'id': page['id'], 'counts': {}, 'digests': {}}
+                )
+            for ext, n in page['counts'].items():
+                target['counts'][ext] = target['counts'].get(ext, 0) + n
+            for alg, by_ext in page['digests'].items():
+                for ext, entries in by_ext.items():
+                    target['digests'].setdefault(alg, {}).setdefault(
+                        ext, {}).update(entries)
+            for ext, entries in page.get('ocr', {}).items():
+                target.setdefault('ocr', {}).setdefault(ext, {}).update(entries)
+            if 'images' in page:
+                target.setdefault('images', {}).update(page['images'])
+    merged['pages'] = [merged['pages'][id] for id in sorted(merged['pages'])]
+    return merged
+
+
+def saved(path, summaries, algorithms=(), ocr=False, images=False,
+          stats=False, **info):
+    """ Yields each of summaries, which must be sorted by identifier, after
+        saving it to a gzipped JSON Lines partial result at path. The first
+        line records the algorithms of the digests, whether sidecars were
+        checked, images probed and file stats included, and any further
+        info, such as the root and shard. """
+    with Output(path, compress=True) as handle:
+        handle.write(json.dumps({
+            'partial': PARTIAL_VERSION, 'fixity': list(algorithms),
+            'ocr': ocr, 'images': images, 'files': stats, **info
+            }) + "\n")
+        for summary in summaries:
+            handle.write(json.dumps(summary) + "\n")
+            yield summary
+
+
+def write_partial(path, items, digests=None, algorithms=(), ocr=None,
+                  probes=None, stats=False, **info):
+    """ Saves the summaries of items, sorted by identifier, as a partial
+        result. """
+    summaries = (item_summary(item, digests, algorithms, ocr, probes, stats)
+                 for item in sorted(items))
+    for _ in saved(path, summaries, algorithms, ocr is not None,
+                   probes is not None, stats, **info):
+        pass
+
+
+def read_partial(path):
+    """ Returns the first line of a partial result and an iterator over its
+        item summaries. """
+    handle = gzip.open(path, 'rt', encoding='utf-8')
+    try:
+        info = json.loads(handle.readline())
+    except (OSError, EOFError, ValueError):
+        info = None
+    if not isinstance(info, dict) or info.get('partial') != PARTIAL_VERSION:
+        handle.close()
+        raise ValueError(f"{path} is not a partial result")
+
+    def summaries():
+        with handle:
+            for line in handle:
+                yield json.loads(line)
+    return info, summaries()
+
+
+def merge_partials(paths):
+    """ Returns the digest algorithms of the partial results at paths, whether
+        their sidecars were checked and their images probed, and an iterator
+        over their merged item summaries, in identifier order. Only one item
+        from each partial is held in memory at a time. """
+    partials = [read_partial(path) for path in paths]
+    columns = {(tuple(info['fixity']), info.get('ocr', False),
+                info.get('images', False)) for info, _ in partials}
+    if len(columns) > 1:
+        raise ValueError("The partial results have different columns")
+    algorithms, ocr, images = columns.pop()
+    merged = heapq.merge(*(summaries for _, summaries in partials),
+                         key=itemgetter('id'))
+    return (list(algorithms), ocr, images,
+            (merge_summaries(list(group))
+             for _, group in groupby(merged, key=itemgetter('id'))))
+
+
+def item_totals(summary):
+    """ Returns the number of item-level files of an item summary and the
+        number of its page files with each counted extension, or zeros for an
+        item that is absent. """
+    if summary is None:
+        return [0] * (1 + len(COUNTED))
+    return [summary['item_files']] + [
+        sum(page['counts'].get(ext, 0) for page in summary['pages'])
+        for ext in COUNTED
+        ]
+
+
+def item_changes(before, after):
+    """ Compares two summaries of an item, either of which may be None, by the
+        size and mtime of their files. Returns None if no file was added,
+        removed or changed, and otherwise a dict of the item's change, the
+        deltas of its totals and its (path, change) pairs in path order. """
+    old = before['files'] if before else {}
+    new = after['files'] if after else {}
+    files = [(path, 'added') for path in new.keys() - old.keys()]
+    files += [(path, 'removed') for path in old.keys() - new.keys()]
+    files += [(path, 'changed') for path in new.keys() & old.keys()
+              if new[path] != old[path]]
+    if not files:
+        return None
+    return {
+        'id': (after or before)['id'],
+        'change': ('added' if before is None else
+                   'removed' if after is None else 'changed'),
+        'deltas': [a - b for a, b in zip(item_totals(after),
+                                         item_totals(before))],
+        'files': sorted(files, key=lambda entry: entry[0].split(os.sep)),
+        }
+
+
+def diff_summaries(before, after):
+    """ Yields the changes of the items whose files differ between two
+        streams of item summaries, each sorted by identifier, matching the
+        summaries of each item in a single merge pass. """
+    tagged = heapq.merge(((summary['id'], 0, summary) for summary in before),
+                         ((summary['id'], 1, summary) for summary in after),
+                         key=itemgetter(0, 1))
+    for _, group in groupby(tagged, key=itemgetter(0)):
+        sides = [None, None]
+        for _, side, summary in group:
+            sides[side] = summary
+        changes = item_changes(*sides)
+        if changes is not None:
+            yield changes
+
+
+def diff_writer(handle, format='csv'):
+    """ Returns a function that writes a list of item changes to handle, as
+        CSV rows (a row of deltas for each item followed by a row for each
+        file) or as one JSON object per item. """
+    if format == 'jsonl':
+        def write(changes):
+            handle.write("".join(json.dumps({
+                'id': change['id'], 'change': change['change'],
+                **dict(zip(HEADER[1:], change['deltas'])),
+                'files': [{'path': path, 'change': what}
+                          for path, what in change['files']],
+                }) + "\n" for change in changes))
+            handle.flush()
+    else:
+        writer = csv.writer(handle)
+        writer.writerow(DIFF_HEADER)
+        def write(changes):
+            for change in changes:
+                writer.writerow([change['id'], change['change'], None] +
+                                change['deltas'])
+                writer.writerows([change['id'], what, path]
+                                 for path, what in change['files'])
+            handle.flush()
+    return write
+
+
+def item_record(rows, header):
+    """ Returns the report rows of an item as a single JSON-ready dict, with its
+        pages nested under "pages". """
+    def fields(row):
+        return {key: value for n, (key, value) in enumerate(zip(header, row))
+                if n == 0 or value is not None}
+    record = fields(rows[0])
+    record["pages"] = [fields(row) for row in rows[1:]]
+    return record
+
+
+def report_writer(handle, format='csv', digests=None, algorithms=(),
+                  ocr=None, probes=None):
+    """ Returns a function that writes a list of items to handle, as CSV rows or
+        as one JSON object per item. """
+    header = report_header(algorithms, ocr is not None, probes is not None)
+    if format == 'jsonl':
+        def write(items):
+            handle.write("".join(
+                json.dumps(item_record(
+                    item_rows(item, digests, algorithms, ocr, probes), header
+                    )) + "\n"
+                for item in items
+                ))
+            handle.flush()
+    else:
+        writer = csv.writer(handle)
+        writer.writerow(header)
+        def write(items):
+            for item in items:
+                writer.writerows(item_rows(item, digests, algorithms, ocr, probes))
+            handle.flush()
+    return write
+
+
+def parse_shard(ctx, param, value):
+    """ Converts a shard given as K/N into (K, N). """
+    if value is None:
+        return None
+    try:
+        shard, shards = (int(n) for n in value.split('/'))
+    except ValueError:
+        raise click.BadParameter("must be of the form K/N")
+    if not 0 <= shard < shards:
+        raise click.BadParameter("K must be at least 0 and less than N")
+    return shard, shards
 
 
 @click.command()
-@click.argument('root')
-def validate(root):
+@click.argument('roots', metavar='ROOT...', nargs=-1, required=True)
+@click.option('--workers', default=DEFAULT_WORKERS, show_default=True,
+              help='Number of threads used to crawl the directory tree.')
+@click.option('--concurrency', type=click.IntRange(min=1),
+              help='Crawl with asyncio, keeping up to this many directory '
+                   'listings and file stats in flight. Suited to network '
+                   'storage, where each is a round trip.')
+@click.option('--naming', default='default', show_default=True,
+              help='Registered file naming convention of the collection.')
+@click.option('--cache/--no-cache', default=False, show_default=True,
+              help='Reuse a saved manifest of the tree, rescanning only '
+                   'directories that have changed since the last run.')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help='Directory holding saved manifests.')
+@click.option('--report', type=click.Path(dir_okay=False),
+              help='Write the report to this file instead of stdout.')
+@click.option('--format', type=click.Choice(FORMATS),
+              help='Report format; by default jsonl for a report named .json '
+                   'or .jsonl, otherwise csv.')
+@click.option('--gzip', 'compress', is_flag=True,
+              help='Gzip the report (implied by a report name ending .gz).')
+@click.option('--shard', callback=parse_shard, metavar='K/N',
+              help='Validate only the Kth of N shards of the root, counting '
+                   'from 0. The directories below the root are divided among '
+                   'the shards by a hash of their paths.')
+@click.option('--partial', type=click.Path(dir_okay=False),
+              help='Instead of a report, save a partial result to this file '
+                   'to be combined with others by merge.')
+@click.option('--watch', is_flag=True,
+              help='After the report, keep running and append the counts of '
+                   'each item whose files change.')
+@click.option('--interval', default=2.0, show_default=True,
+              help='Seconds between checks for changes (or to collect '
+                   'filesystem events) in watch mode.')
+@click.option('--polling', is_flag=True,
+              help='Detect changes by checking directory mtimes rather than '
+                   'with inotify.')
+@click.option('--fixity', multiple=True, type=click.Choice(FIXITY_ALGORITHMS),
+              help='Add a column of file digests made with this algorithm '
+                   '(repeatable).')
+@click.option('--fixity-workers', default=FIXITY_WORKERS, show_default=True,
+              help='Number of threads hashing files.')
+@click.option('--fixity-rate', type=int,
+              help='Limit hashing to this many bytes per second.')
+@click.option('--fixity-cache/--no-fixity-cache', default=True,
+              show_default=True,
+              help='Reuse saved digests of files whose size and mtime are '
+                   'unchanged.')
+@click.option('--ocr-check', is_flag=True,
+              help='Add columns giving the outcome of checking each page\'s '
+                   'hOCR and XML sidecars: ok, empty, unreadable, malformed, '
+                   'truncated, wrong_page or no_page_id.')
+@click.option('--ocr-workers', type=click.IntRange(min=1),
+              help='Number of processes checking sidecars [default: one per '
+                   'CPU].')
+@click.option('--image-check', is_flag=True,
+              help='Add columns giving the outcome of probing the header of '
+                   'each page\'s TIFF and JPEG images (ok, empty, '
+                   'unreadable, wrong_format, malformed or truncated) and '
+                   'their format, dimensions, bit depth and compression.')
+@click.option('--image-workers', default=8, show_default=True,
+              help='Number of threads probing images.')
+@click.option('--image-cache/--no-image-cache', default=True,
+              show_default=True,
+              help='Reuse saved probes of images whose size and mtime are '
+                   'unchanged.')
+@click.option('--snapshot', type=click.Path(dir_okay=False),
+              help='Also save the items, with the size and mtime of each '
+                   'file, to this file for a later --diff.')
+@click.option('--diff', type=click.Path(exists=True, dir_okay=False),
+              help='Instead of the full report, report only the items whose '
+                   'files were added, removed or changed (in size or mtime) '
+                   'since this snapshot, with the deltas of their counts.')
+@click.option('--progress', is_flag=True,
+              help='Show a progress line on stderr.')
+@click.option('--metrics-json', type=click.Path(dir_okay=False),
+              help='Save the time and throughput of each stage to this file.')
+@click.option('--profile', is_flag=True,
+              help='Profile each stage, saving pstats and collapsed stacks to '
+                   'a .profile directory beside the report, and list the '
+                   'hottest functions on stderr.')
+def validate(roots, workers, concurrency, naming, cache, cache_dir, report,
+             format, compress, shard, partial, watch, interval, polling,
+             fixity, fixity_workers, fixity_rate, fixity_cache, ocr_check,
+             ocr_workers, image_check, image_workers, image_cache, snapshot,
+             diff, progress, metrics_json, profile):
+    """ Reports the files of each item and page found below ROOT. Several
+        roots are validated one at a time and reported together, with items
+        found under more than one combined. """
     #sys.stderr.write(f'Searching directory: {root}\n')
-    fileset = FileSet(root)
-    for file in fileset:
-        item = Item.from_registry(file.item)
-        if file.seq is not None:
-            page = Page.from_registry(file.base)
-            page.files.add(file)
-            item.pages.add(page)
+    if watch and (fixity or ocr_check or image_check):
+        raise click.UsageError(
+            "--fixity, --ocr-check and --image-check cannot be used with "
+            "--watch")
+    if watch and (len(roots) > 1 or shard or partial):
+        raise click.UsageError(
+            "--watch takes a single ROOT and cannot be used with --shard or "
+            "--partial")
+    if watch and (cache or concurrency or progress or metrics_json):
+        raise click.UsageError(
+            "--cache, --concurrency, --progress and --metrics-json cannot be "
+            "used with --watch")
+    if partial and len(roots) > 1:
+        raise click.UsageError("--partial takes a single ROOT")
+    if cache and shard:
+        raise click.UsageError("--cache cannot be used with --shard")
+    if cache and concurrency:
+        raise click.UsageError("--cache cannot be used with --concurrency")
+    if (snapshot or diff) and (watch or partial):
+        raise click.UsageError(
+            "--snapshot and --diff cannot be used with --watch or --partial")
+    if snapshot and diff and os.path.abspath(snapshot) == os.path.abspath(diff):
+        raise click.UsageError("--snapshot must not overwrite the --diff file")
+    if diff:
+        try:
+            info, before = read_partial(diff)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--diff')
+        if not info.get('files'):
+            raise click.BadParameter(
+                f"{diff} was not saved with --snapshot", param_hint='--diff')
+    stats = bool(snapshot or diff)
+    try:
+        classifier = get_classifier(naming)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--naming')
+    metrics = make_metrics(progress, metrics_json, profile)
+    if profile:
+        from .profiling import profile_directory
+        profile = profile_directory(partial or report)
+    scan = shard_scan(*shard) if shard else scan_dir
+
+    def collect(root, registry):
+        """ Returns the Items found below root, the digests of their files,
+            the outcomes of checking their sidecars and the probes of their
+            images (each None when not made). """
+        # Modules needed only by some options are imported as they are
+        # used, so that a plain run starts quickly.
+        if cache:
+            from .manifest import Manifest
+            manifest = Manifest.for_root(root, cache_dir)
         else:
-            item.files.add(file)
-
-    writer = csv.writer(sys.stdout)
-    writer.writerow(["id","item_files","tif","hocr","xml"])
-
-    for item in sorted(Item._registry.values()):
-        writer.writerow([
-        	item.identifier,
-        	len(item.files)
-        	])
-        for page in sorted(item.pages):
-        	writer.writerow([
-        		page.identifier,
-        		None, # "Item files" column
-        		page.count('.tif'),
-        		page.count('.hocr'),
-        		page.count('.xml')
-        		])
+            manifest = None
+        if concurrency:
+            from .aiocrawl import AsyncCrawler
+            crawler = AsyncCrawler(concurrency, scan=scan)
+        else:
+            crawler = None
+        fileset = FileSet(root, workers, manifest, classifier=classifier,
+                          metrics=metrics, scan=scan, crawler=crawler)
+        if stats:
+            with metrics.timed('stat', 'files') as stage:
+                stage.count += fileset.stat_files(workers)
+        with metrics.timed('tree', 'items') as stage:
+            items = fileset.as_object_tree(registry)
+            stage.count += len(items)
+        if fixity:
+            from .fixity import DigestCache, compute_digests
+            with metrics.timed('fixity', 'files') as stage:
+                stage.count += compute_digests(
+                    fileset, fixity, fixity_workers,
+                    DigestCache() if fixity_cache else None, fixity_rate
+                    )
+        if ocr_check:
+            from .ocr import check_sidecars
+            with metrics.timed('ocr', 'files') as stage:
+                stage.count += check_sidecars(fileset, ocr_workers)
+        if image_check:
+            from .images import ProbeCache, probe_images
+            with metrics.timed('images', 'files') as stage:
+                stage.count += probe_images(
+                    fileset, image_workers,
+                    ProbeCache() if image_cache else None
+                    )
+        return (items, fileset.digests, fileset.ocr if ocr_check else None,
+                fileset.probes if image_check else None)
+
+    registry = Registry()
+    if watch:
+        from .watch import WatchedTree, make_watcher, watch as watch_tree
+        tree = WatchedTree(roots[0], registry, classifier, workers)
+        items = sorted(tree.items)
+        digests = ocr = probes = None
+    elif partial:
+        items, digests, ocr, probes = collect(roots[0], registry)
+        with metrics.timed('write', 'items') as stage:
+            write_partial(partial, items, digests, fixity, ocr, probes,
+                          root=os.path.abspath(roots[0]),
+                          shard="/".join(map(str, shard)) if shard else None)
+            stage.count = len(items)
+        finish(metrics, metrics_json, profile)
+        return
+    elif len(roots) > 1:
+        # Each root's partial result is saved before the next is read, so
+        # that only one root's files are held in memory at a time.
+        workdir = tempfile.TemporaryDirectory()
+        paths = []
+        for n, root in enumerate(roots):
+            items, digests, ocr, probes = collect(root, registry)
+            paths.append(os.path.join(workdir.name, f"{n}.jsonl.gz"))
+            write_partial(paths[-1], items, digests, fixity, ocr, probes,
+                          stats)
+            registry.release()
+        digests = None
+        items = merge_partials(paths)[3]
+    else:
+        items, digests, ocr, probes = collect(roots[0], registry)
+        items = sorted(items)
+
+    if stats:
+        items = (item if isinstance(item, dict) else
+                 item_summary(item, digests, fixity, ocr, probes, stats)
+                 for item in items)
+    if snapshot:
+        items = saved(snapshot, items, fixity, ocr is not None,
+                      probes is not None, stats,
+                      roots=[os.path.abspath(root) for root in roots],
+                      shard="/".join(map(str, shard)) if shard else None)
+    with Output(report, compress) as handle:
+        if diff:
+            items = diff_summaries(before, items)
+            write = diff_writer(handle, format or guess_format(report))
+        else:
+            write = report_writer(handle, format or guess_format(report),
+                                  digests, fixity, ocr, probes)
+        with metrics.timed('write', 'items') as stage:
+            for batch in batched(items):
+                write(batch)
+                stage.count += len(batch)
+        finish(metrics, metrics_json, profile)
+        if watch:
+            watch_tree(tree, make_watcher(tree, interval, polling), write)
+
+
+def finish(metrics, metrics_json, profile=None):
+    """ Ends the progress line and saves the metrics and, when profile names a
+        directory, the profile of the run. """
+    metrics.finish()
+    if metrics_json:
+        metrics.write_json(metrics_json)
+    if profile:
+        metrics.close(profile)
+
+
+def batched(items, size=1024):
+    """ Yields lists of up to size items. """
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+@click.command()
+@click.argument('partials', metavar='PARTIAL...', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--report', type=click.Path(dir_okay=False),
+              help='Write the report to this file instead of stdout.')
+@click.option('--format', type=click.Choice(FORMATS),
+              help='Report format; by default jsonl for a report named .json '
+                   'or .jsonl, otherwise csv.')
+@click.option('--gzip', 'compress', is_flag=True,
+              help='Gzip the report (implied by a report name ending .gz).')
+@click.option('--profile', is_flag=True,
+              help='Profile the merge, saving pstats and collapsed stacks to '
+                   'a .profile directory beside the report, and list the '
+                   'hottest functions on stderr.')
+def merge(partials, report, format, compress, profile):
+    """ Combines partial results saved by validate --partial into a single
+        report, sorted by identifier. """
+    try:
+        algorithms, ocr, images, items = merge_partials(partials)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    metrics = make_metrics(profile=profile)
+    if profile:
+        from .profiling import profile_directory
+        profile = profile_directory(report)
+    with Output(report, compress) as handle:
+        # The merged summaries hold the outcomes of any sidecar checks and
+        # image probes, so empty dicts only turn on their columns.
+        write = report_writer(handle, format or guess_format(report), None,
+                              algorithms, {} if ocr else None,
+                              {} if images else None)
+        with metrics.timed('write', 'items') as stage:
+            for batch in batched(items):
+                write(batch)
+                stage.count += len(batch)
+    finish(metrics, None, profile)
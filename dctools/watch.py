@@ -0,0 +1,245 @@
+""" Keeps the Item/Page tree of a FileSet current as files under its root are
+    added and removed, listing again only the directories that change. """
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+try:
+    from .archelon import Item, Page
+    from .binaries import DEFAULT_WORKERS, FileSet, scan_tree
+    from .manifest import list_dir
+except ImportError:
+    from archelon import Item, Page
+    from binaries import DEFAULT_WORKERS, FileSet, scan_tree
+    from manifest import list_dir
+
+
+class WatchedTree:
+    """ The Items and Pages built from a root, along with a listing of every
+        directory under it so that changes can be applied directory by
+        directory. """
+
+    def __init__(self, root, registry, classifier,
+                 workers=DEFAULT_WORKERS):
+        self.root = root
+        self.registry = registry
+        self.classifier = classifier
+        self.listings = {}
+        self.files = {}
+        self.fileset = FileSet(
+            root,
+            records=classifier.classify_all(scan_tree(root, workers, self.scan)),
+            classifier=classifier
+            )
+        for f in self.fileset:
+            self.files[f.path] = f
+        self.fileset.as_object_tree(registry)
+
+    @property
+    def items(self):
+        return self.registry.values(Item)
+
+    def scan(self, root, reldir):
+        """ Lists a directory as scan_dir does, recording the listing along with
+            the directory's mtime taken beforehand. """
+        listing = list_dir(root, reldir)
+        if listing is None:
+            return [], []
+        self.listings[reldir] = listing
+        _, files, subdirs = listing
+        return files, subdirs
+
+    def refresh(self, reldirs):
+        """ Lists the given directories again, applies the files added to and
+            removed from them to the tree, and returns the identifiers of the
+            items whose files changed. """
+        added = []
+        removed = []
+        for reldir in reldirs:
+            if reldir in self.listings:
+                self.update(reldir, added, removed)
+        changed = set()
+        for f in removed:
+            if f.item is not None:
+                changed.add(f.item)
+            self.remove(f)
+        if added:
+            fileset = FileSet(self.root,
+                              records=self.classifier.classify_batch(added),
+                              classifier=self.classifier)
+            for f in fileset:
+                if f.item is not None:
+                    changed.add(f.item)
+                self.add(f)
+        return changed
+
+    def update(self, reldir, added, removed, exists=True):
+        _, old_files, old_subdirs = self.listings.pop(reldir, (None, [], []))
+        if exists:
+            files, subdirs = self.scan(self.root, reldir)
+        else:
+            files, subdirs = [], []
+        added.extend(set(files).difference(old_files))
+        removed.extend(self.files[p] for p in set(old_files).difference(files))
+        for subdir in set(old_subdirs).difference(subdirs):
+            self.update(subdir, added, removed, exists=False)
+        for subdir in set(subdirs).difference(old_subdirs):
+            self.update(subdir, added, removed)
+
+    def add(self, f):
+        self.files[f.path] = f
+        if f.item is None:
+            return
+        item = Item.from_registry(f.item, self.registry)
+        if f.seq is not None:
+            page = Page.from_registry(f.base, self.registry)
+            page.add_file(f)
+            item.pages.add(page)
+        else:
+            item.add_file(f)
+
+    def remove(self, f):
+        del self.files[f.path]
+        if f.item is None:
+            return
+        item = Item.from_registry(f.item, self.registry)
+        if f.seq is not None:
+            page = Page.from_registry(f.base, self.registry)
+            page.discard_file(f)
+            if not page.files:
+                item.pages.discard(page)
+                self.registry.discard(Page, page.identifier)
+        else:
+            item.discard_file(f)
+        if not item.files and not item.pages:
+            self.registry.discard(Item, item.identifier)
+
+
+class PollingWatcher:
+    """ Finds changed directories by comparing their mtimes with those recorded
+        when they were last listed. """
+
+    def __init__(self, tree, interval):
+        self.tree = tree
+        self.interval = interval
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            changed = set()
+            for reldir, (mtime, _, _) in list(self.tree.listings.items()):
+                try:
+                    current = os.stat(
+                        os.path.join(self.tree.root, reldir)
+                        ).st_mtime_ns
+                except OSError:
+                    current = None
+                if mtime is None or current != mtime:
+                    changed.add(reldir)
+            if changed:
+                return changed
+
+
+class InotifyWatcher:
+    """ Finds changed directories from Linux inotify events, with a watch on
+        every listed directory. Events arriving within interval seconds of the
+        first are collected together. """
+
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    mask = (IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+            IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    header = struct.Struct('iIII')
+
+    def __init__(self, tree, interval):
+        self.tree = tree
+        self.interval = interval
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.add_watches()
+
+    def add_watches(self):
+        watched = set(self.watches.values())
+        for reldir in list(self.tree.listings):
+            if reldir not in watched:
+                path = os.path.join(self.tree.root, reldir)
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(path), self.mask
+                    )
+                if wd >= 0:
+                    self.watches[wd] = reldir
+                elif ctypes.get_errno() not in (errno.ENOENT, errno.ENOTDIR):
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def read_events(self, changed):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.header.unpack_from(data, offset)
+            offset += self.header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                changed.update(self.tree.listings)
+            elif mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches:
+                changed.add(self.watches[wd])
+
+    def wait(self):
+        self.add_watches()
+        changed = set()
+        while not changed:
+            select.select([self.fd], [], [])
+            deadline = time.monotonic() + self.interval
+            while (remaining := deadline - time.monotonic()) > 0:
+                if select.select([self.fd], [], [], remaining)[0]:
+                    self.read_events(changed)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(tree, interval, polling=False):
+    """ Returns an InotifyWatcher where inotify is available, and otherwise a
+        PollingWatcher. """
+    if not polling:
+        try:
+            return InotifyWatcher(tree, interval)
+        except (AttributeError, OSError):
+            pass
+    return PollingWatcher(tree, interval)
+
+
+def watch(tree, watcher, report):
+    """ Applies each batch of changes to the tree and passes the items whose
+        files changed to report, until interrupted. Items left with no files
+        are passed as identifiers alone. """
+    try:
+        while True:
+            changed = tree.refresh(watcher.wait())
+            if changed:
+                current = {item.identifier: item for item in tree.items}
+                report([current.get(i, i) for i in sorted(changed, key=str)])
+    except KeyboardInterrupt:
+        pass
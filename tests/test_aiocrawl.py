@@ -0,0 +1,18 @@
+import time
+
+from dctools.aiocrawl import BATCH_SIZE, AsyncCrawler
+
+
+def test_slow_consumer_gets_every_batch(tmp_path):
+    """ The crawl finishes with batches still queued, which are consumed
+        after its event loop has closed. """
+    for n in range(4):
+        directory = tmp_path / f"dir{n}"
+        directory.mkdir()
+        for m in range(BATCH_SIZE):
+            (directory / f"abc-{n:06d}-{m:04d}.tif").touch()
+    relpaths = []
+    for batch in AsyncCrawler(8, max_pending=2).crawl(str(tmp_path)):
+        time.sleep(0.05)
+        relpaths.extend(relpath for relpath, _, _ in batch)
+    assert len(relpaths) == len(set(relpaths)) == 4 * BATCH_SIZE
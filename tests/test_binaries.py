@@ -0,0 +1,77 @@
+from dctools.binaries import FileSet, scan_tree, shard_scan
+
+
+def test_shards_divide_a_single_top_level_directory(tmp_path):
+    """ A root holding one directory is still divided among the shards. """
+    for n in range(12):
+        directory = tmp_path / "batch0000" / f"abc-{n:06d}"
+        directory.mkdir(parents=True)
+        (directory / f"abc-{n:06d}-0001.tif").touch()
+    (tmp_path / "manifest.txt").touch()
+    shards = [set(scan_tree(str(tmp_path), scan=shard_scan(k, 3)))
+              for k in range(3)]
+    assert all(shards)
+    assert set.union(*shards) == set(scan_tree(str(tmp_path)))
+    assert sum(map(len, shards)) == 13
+    assert "manifest.txt" in shards[0]
+
+
+def make_fileset(root, items=4, pages=6):
+    for n in range(1, items + 1):
+        item = f"abc-{n:06d}"
+        directory = root / item
+        directory.mkdir(parents=True)
+        (directory / f"{item}.xml").touch()
+        for seq in range(1, pages + 1):
+            (directory / f"{item}-{seq:04d}.tif").touch()
+    return FileSet(str(root))
+
+
+def paths(files):
+    return [f.path for f in files]
+
+
+def test_partition_orphans_pages_before_the_first_row(tmp_path):
+    partition = make_fileset(tmp_path).partition(["abc-000001-0003"])
+    assert partition.orphan_pages() == ["abc-000001-0001", "abc-000001-0002"]
+    assert [f.seq for f in partition.get_members("abc-000001-0003")] == [
+        3, 4, 5, 6]
+    assert partition.overlaps == []
+
+
+def test_partition_reports_duplicate_identifiers(tmp_path):
+    partition = make_fileset(tmp_path).partition(["abc-000002", "abc-000002"])
+    assert partition.overlaps == [("abc-000002", "abc-000002")]
+    assert len(partition.get_members("abc-000002")) == 6
+
+
+def test_partition_splits_a_whole_item_also_described_in_parts(tmp_path):
+    partition = make_fileset(tmp_path).partition(
+        ["abc-000003-0004", "abc-000003"]
+        )
+    assert partition.overlaps == [("abc-000003", "abc-000003-0004")]
+    assert [f.seq for f in partition.get_members("abc-000003")] == [1, 2, 3]
+    assert [f.seq for f in partition.get_members("abc-000003-0004")] == [
+        4, 5, 6]
+    assert partition.orphans.tolist() == []
+
+
+def test_partition_gives_a_last_split_row_the_rest_of_the_item(tmp_path):
+    partition = make_fileset(tmp_path).partition(
+        ["abc-000004-0001", "abc-000004-0005"]
+        )
+    assert [f.seq for f in partition.get_members("abc-000004-0005")] == [5, 6]
+
+
+def test_partition_agrees_with_get_members_on_a_sorted_batch(tmp_path):
+    fileset = make_fileset(tmp_path)
+    identifiers = ["abc-000001", "abc-000002-0001", "abc-000002-0003",
+                   "abc-000003", "abc-000004-0001", "abc-000004-0005",
+                   "abc-000005"]
+    partition = fileset.partition(identifiers)
+    for identifier, next_id in zip(identifiers, identifiers[1:] + [None]):
+        assert paths(partition.get_members(identifier)) == paths(
+            fileset.get_members(identifier, next_id)
+            ), identifier
+    assert partition.orphans.tolist() == []
+    assert partition.overlaps == []
@@ -0,0 +1,80 @@
+import struct
+
+from dctools.images import (MALFORMED, OK, TRUNCATED, WRONG_FORMAT,
+                            probe_image)
+
+
+def tiff(width=4, height=2, big=False, strip=8, data=8, counts=None):
+    """ Returns a little-endian TIFF (or BigTIFF) of one 8-bit strip of strip
+        bytes, followed by data bytes of image data. counts overrides the
+        count of tags. """
+    counts = counts or {}
+    if big:
+        header = b'II+\x00' + struct.pack('<HHQ', 8, 0, 16)
+        count_code, entry_code, value_size = 'Q', '<HHQ', 8
+    else:
+        header = b'II*\x00' + struct.pack('<I', 8)
+        count_code, entry_code, value_size = 'H', '<HHI', 4
+    entry_size = struct.calcsize(entry_code) + value_size
+    tags = [(256, 3, width), (257, 3, height), (258, 3, 8), (259, 3, 1),
+            (273, 4, None), (277, 3, 1), (279, 4, strip)]
+    ifd_size = (struct.calcsize(count_code) + len(tags) * entry_size +
+                value_size)
+    offset = len(header) + ifd_size
+    ifd = struct.pack('<' + count_code, len(tags))
+    for tag, type, value in tags:
+        value = offset if value is None else value
+        code = '<H' if type == 3 else '<I'
+        ifd += struct.pack(entry_code, tag, type, counts.get(tag, 1))
+        ifd += struct.pack(code, value).ljust(value_size, b'\x00')
+    ifd += b'\x00' * value_size
+    return header + ifd + b'\x00' * data
+
+
+def jpeg(width=4, height=2, end=True):
+    frame = struct.pack('>BHHB', 8, height, width, 3) + b'\x00' * 9
+    return (b'\xff\xd8' + b'\xff\xc0' + struct.pack('>H', len(frame) + 2) +
+            frame + b'\xff\xda' + b'\x00' * 16 + (b'\xff\xd9' if end else b''))
+
+
+def probe(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return probe_image(str(path))
+
+
+def test_tiff(tmp_path):
+    result = probe(tmp_path, "a.tif", tiff())
+    assert result.status == OK
+    assert result.describe() == "tiff 4x2 1x8-bit none"
+
+
+def test_bigtiff(tmp_path):
+    result = probe(tmp_path, "a.tif", tiff(width=300, big=True))
+    assert result.status == OK
+    assert (result.width, result.height) == (300, 2)
+
+
+def test_truncated_tiff(tmp_path):
+    assert probe(tmp_path, "a.tif", tiff(data=4)).status == TRUNCATED
+
+
+def test_tiff_with_a_zero_count_tag(tmp_path):
+    result = probe(tmp_path, "a.tif", tiff(counts={256: 0}))
+    assert result.status == MALFORMED
+
+
+def test_jpeg(tmp_path):
+    result = probe(tmp_path, "a.jpg", jpeg())
+    assert result.status == OK
+    assert result.describe() == "jpeg 4x2 3x8-bit baseline"
+
+
+def test_truncated_jpeg(tmp_path):
+    assert probe(tmp_path, "a.jpg", jpeg(end=False)).status == TRUNCATED
+
+
+def test_wrong_format(tmp_path):
+    result = probe(tmp_path, "a.tif", jpeg())
+    assert (result.status, result.format) == (WRONG_FORMAT, "jpeg")
+    assert probe(tmp_path, "b.tif", b"not an image").status == WRONG_FORMAT
@@ -0,0 +1,61 @@
+import os
+import shutil
+
+from dctools.binaries import FileSet
+from dctools.manifest import SETTLE_NS, Manifest
+
+
+def make_tree(root):
+    for n in range(1, 4):
+        item = root / "batch0000" / f"abc-{n:06d}"
+        item.mkdir(parents=True)
+        for seq in range(1, 4):
+            (item / f"abc-{n:06d}-{seq:04d}.tif").touch()
+
+
+def settle(root):
+    """ Dates every directory below root back past SETTLE_NS. """
+    past = os.stat(root).st_mtime_ns - 10 * SETTLE_NS
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, ns=(past, past))
+
+
+def refreshed(root, manifest):
+    return sorted(FileSet(str(root), manifest=manifest).paths)
+
+
+def crawled(root):
+    return sorted(FileSet(str(root)).paths)
+
+
+def test_refresh_matches_a_fresh_crawl(tmp_path):
+    root = tmp_path / "root"
+    make_tree(root)
+    manifest = Manifest.for_root(root, tmp_path / "cache")
+    assert refreshed(root, manifest) == crawled(root)
+    settle(root)
+    assert refreshed(root, manifest) == crawled(root)
+    assert all(d.mtime is not None
+               for d in manifest.load(FileSet(str(root))).values())
+
+    (root / "batch0000" / "abc-000001" / "abc-000001-0004.tif").touch()
+    (root / "batch0000" / "abc-000002" / "abc-000002-0001.tif").unlink()
+    shutil.rmtree(root / "batch0000" / "abc-000003")
+    (root / "batch0001" / "abc-000004").mkdir(parents=True)
+    (root / "batch0001" / "abc-000004" / "abc-000004-0001.tif").touch()
+    assert refreshed(root, manifest) == crawled(root)
+    assert "batch0001/abc-000004/abc-000004-0001.tif" in crawled(root)
+
+
+def test_recently_changed_directories_are_listed_again(tmp_path):
+    root = tmp_path / "root"
+    make_tree(root)
+    manifest = Manifest.for_root(root, tmp_path / "cache")
+    refreshed(root, manifest)
+    # A file added in the same clock tick as the last listing leaves the
+    # directory's mtime as it was.
+    item = root / "batch0000" / "abc-000001"
+    mtime = os.stat(item).st_mtime_ns
+    (item / "abc-000001-0004.tif").touch()
+    os.utime(item, ns=(mtime, mtime))
+    assert refreshed(root, manifest) == crawled(root)
@@ -0,0 +1,50 @@
+import csv
+
+from dctools.binaries import FileSet
+from dctools.populate_files_column import ArchelonBatchCsv
+
+FORMATS = ["http://vocab.lib.umd.edu/form#photographs",
+           "http://vocab.lib.umd.edu/form#books",
+           "http://vocab.lib.umd.edu/form#postcards"]
+
+
+def make_batch(root):
+    """ Makes a tree of 12 items of 6 pages, each with an item-level file,
+        and a batch CSV describing them, with item 3 split into two parts. """
+    identifiers = []
+    for n in range(1, 13):
+        item = f"abc-{n:06d}"
+        directory = root / "files" / f"batch{n % 3:04d}" / item
+        directory.mkdir(parents=True)
+        (directory / f"{item}.xml").touch()
+        for seq in range(1, 7):
+            for ext in (".tif", ".hocr"):
+                (directory / f"{item}-{seq:04d}{ext}").touch()
+        identifiers += [f"{item}-0001", f"{item}-0004"] if n == 3 else [item]
+    with open(root / "batch.csv", "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["Identifier", "Format", "Title"])
+        for n, identifier in enumerate(identifiers):
+            writer.writerow([identifier, FORMATS[n % 3], f"Item {n}"])
+    return root / "batch.csv", FileSet(str(root / "files"))
+
+
+def output(tmp_path, metadata, files, name, **kwargs):
+    stream = kwargs.pop('stream', False)
+    batch = ArchelonBatchCsv(metadata, stream=stream)
+    batch.add_columns(files, **kwargs)
+    path = tmp_path / name
+    batch.write(str(path))
+    return path.read_bytes()
+
+
+def test_pooled_and_streamed_output_match_serial(tmp_path):
+    metadata, files = make_batch(tmp_path)
+    serial = output(tmp_path, metadata, files, "serial.csv", workers=1)
+    assert b"abc-000003-0004" in serial
+    assert output(tmp_path, metadata, files, "pooled.csv",
+                  workers=3, chunksize=2) == serial
+    assert output(tmp_path, metadata, files, "streamed.csv",
+                  stream=True) == serial
+    assert output(tmp_path, metadata, files, "both.csv",
+                  stream=True, workers=3, chunksize=2) == serial
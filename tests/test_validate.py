@@ -0,0 +1,32 @@
+from click.testing import CliRunner
+
+from dctools.validate import merge, validate
+
+
+def make_tree(root):
+    item = root / "batch0000" / "abc-000001"
+    item.mkdir(parents=True)
+    for name in ("abc-000001-0001.tif", "abc-000001-0001.hocr",
+                 "abc-000001.xml"):
+        (item / name).touch()
+    (root / "Thumbs.db").touch()
+    (root / "batch0000" / "README.txt").touch()
+
+
+def test_files_not_named_for_an_item_are_left_out(tmp_path):
+    make_tree(tmp_path / "root")
+    runner = CliRunner()
+    report = runner.invoke(validate, [str(tmp_path / "root")])
+    assert report.exit_code == 0, report.output
+    assert report.output.splitlines() == [
+        "id,item_files,tif,hocr,xml",
+        "abc-000001,1",
+        "abc-000001-0001,,1,1,0",
+        ]
+    partial = str(tmp_path / "partial.jsonl.gz")
+    result = runner.invoke(validate, [str(tmp_path / "root"),
+                                      "--partial", partial])
+    assert result.exit_code == 0, result.output
+    merged = runner.invoke(merge, [partial])
+    assert merged.exit_code == 0, merged.output
+    assert merged.output == report.output
@@ -0,0 +1,20 @@
+from dctools.archelon import Registry
+from dctools.binaries import get_classifier
+from dctools.watch import WatchedTree
+
+
+def test_files_not_named_for_an_item_are_left_out(tmp_path):
+    item = tmp_path / "batch0000" / "abc-000001"
+    item.mkdir(parents=True)
+    (item / "abc-000001-0001.tif").touch()
+    (tmp_path / "Thumbs.db").touch()
+    tree = WatchedTree(str(tmp_path), Registry(), get_classifier('default'))
+    assert [i.identifier for i in sorted(tree.items)] == ["abc-000001"]
+
+    (item / "abc-000001-0002.tif").touch()
+    (item / "README.txt").touch()
+    (tmp_path / "Thumbs.db").unlink()
+    changed = tree.refresh(list(tree.listings))
+    assert changed == {"abc-000001"}
+    assert [i.identifier for i in sorted(tree.items)] == ["abc-000001"]
+    assert len(sorted(tree.items)[0].pages) == 2